@@ -0,0 +1,195 @@
+"""
+benchmark.py: Throughput benchmark and profiler mode for mnist_ddp.py.
+
+run_benchmark trains for a fixed number of optimizer steps after a
+warm-up and times every step. Each step's time is split into data
+loading, forward/backward compute, the all-reduce time the backward pass
+could not hide, and the optimizer. Rank 0 gathers every rank's numbers
+and writes a JSON report: samples/sec per rank and for the job, and
+step-time percentiles. Runs at different world sizes are compared by
+their reports.
+
+DDP overlaps the all-reduce with the backward pass, so it cannot be timed
+on its own. Instead, backward passes under no_sync() are timed first to
+calibrate pure compute. Any extra time a synchronizing backward takes is
+counted as exposed all-reduce.
+"""
+import json
+import socket
+import time
+from contextlib import nullcontext
+import numpy as np
+import torch.nn.functional as F
+import torch.distributed as dist
+from torch.profiler import ProfilerActivity, profile, record_function, schedule, tensorboard_trace_handler
+
+PERCENTILES = (50, 90, 99)
+
+def _batches(loader, sampler, epoch=1):
+    # Endless stream of batches, reshuffled every pass like the epochs
+    while True:
+        sampler.set_epoch(epoch)
+        yield from loader
+        epoch += 1
+
+def _percentiles(times):
+    times = np.asarray(times)
+    stats = {f"p{p}": float(np.percentile(times, p)) for p in PERCENTILES}
+    stats.update(mean=float(times.mean()), max=float(times.max()))
+    return stats
+
+def _profiler(trace_dir, rank, steps, active):
+    # Skips one step and warms up on one when the run has steps to spare,
+    # then records up to `active`, so short runs still record something
+    warmup = 1 if steps > 1 else 0
+    wait = 1 if steps > 2 else 0
+    active = max(min(active, steps - wait - warmup), 1)
+    return profile(
+        activities=[ProfilerActivity.CPU],
+        schedule=schedule(wait=wait, warmup=warmup, active=active, repeat=1),
+        on_trace_ready=tensorboard_trace_handler(trace_dir, worker_name=f"rank{rank}"),
+        record_shapes=False,
+    )
+
+def run_benchmark(model, optimizer, train_loader, sampler, device, args, allreduce_bytes):
+    """
+    Runs args.warmup_steps + args.benchmark_steps optimizer steps of
+    args.accum_steps micro-batches each. Every rank must call it. Returns
+    the report on rank 0, None elsewhere.
+    """
+    rank = dist.get_rank()
+    world_size = dist.get_world_size()
+    batches = _batches(train_loader, sampler)
+    model.train()
+
+    def micro_batch(sync, label):
+        t0 = time.perf_counter()
+        with label("data"):
+            data, target = next(batches)
+            data, target = data.to(device), target.to(device)
+        t1 = time.perf_counter()
+        with nullcontext() if sync else model.no_sync():
+            with label("forward"):
+                loss = F.nll_loss(model(data), target)
+            t2 = time.perf_counter()
+            with label("backward"):
+                (loss / args.accum_steps).backward()
+        t3 = time.perf_counter()
+        return len(target), t1 - t0, t2 - t1, t3 - t2
+
+    def step(label):
+        samples = data = forward = backward = exposed = 0.0
+        t0 = time.perf_counter()
+        for i in range(args.accum_steps):
+            sync = i == args.accum_steps - 1
+            n, d, f, b = micro_batch(sync, label)
+            samples += n
+            data += d
+            forward += f
+            backward += b
+            if sync:
+                exposed = max(b - compute_backward, 0.0)
+        t1 = time.perf_counter()
+        with label("optimizer"):
+            optimizer.step()
+            optimizer.zero_grad()
+        t2 = time.perf_counter()
+        return {"samples": samples, "step": t2 - t0, "data": data,
+                "compute": forward + backward - exposed, "allreduce": exposed,
+                "optimizer": t2 - t1}
+
+    no_label = lambda name: nullcontext()
+
+    # Warm-up, then calibrate backward compute with gradient sync off
+    compute_backward = 0.0
+    for _ in range(args.warmup_steps):
+        step(no_label)
+    calibration = [micro_batch(False, no_label)[3] for _ in range(max(args.warmup_steps, 5))]
+    compute_backward = float(np.median(calibration))
+    optimizer.zero_grad()
+
+    prof = None
+    if args.profile_trace:
+        prof = _profiler(args.profile_trace, rank, args.benchmark_steps, args.profile_steps)
+        prof.start()
+    label = record_function if prof else no_label
+
+    # Measured steps, started together on every rank
+    dist.barrier()
+    steps = []
+    start = time.perf_counter()
+    for _ in range(args.benchmark_steps):
+        steps.append(step(label))
+        if prof:
+            prof.step()
+    wall = time.perf_counter() - start
+    if prof:
+        prof.stop()
+
+    samples = sum(s["samples"] for s in steps)
+    result = {
+        "rank": rank,
+        "host": socket.gethostname(),
+        "samples": int(samples),
+        "wall_time": wall,
+        "samples_per_sec": samples / wall,
+        "step_time": _percentiles([s["step"] for s in steps]),
+        "split": {k: sum(s[k] for s in steps) / len(steps)
+                  for k in ("data", "compute", "allreduce", "optimizer")},
+        "backward_compute_calibrated": compute_backward,
+    }
+    per_rank = [None] * world_size
+    dist.all_gather_object(per_rank, (result, [s["step"] for s in steps]))
+    if rank != 0:
+        return None
+
+    # Synchronous steps finish together, so a job step is the slowest rank's
+    slowest = np.max([times for _, times in per_rank], axis=0)
+    total = sum(r["samples"] for r, _ in per_rank)
+    job_wall = max(r["wall_time"] for r, _ in per_rank)
+    return {
+        "world_size": world_size,
+        "backend": dist.get_backend(),
+        "batch_size": args.batch_size,
+        "accum_steps": args.accum_steps,
+        "global_batch": args.batch_size * args.accum_steps * world_size,
+        "comm_hook": args.comm_hook,
+        "bucket_cap_mb": args.bucket_cap_mb,
+        "dataset": args.dataset,
+        "warmup_steps": args.warmup_steps,
+        "steps": args.benchmark_steps,
+        "allreduce_bytes_per_step": allreduce_bytes,
+        "samples_per_sec": total / job_wall,
+        "samples_per_sec_per_rank": total / job_wall / world_size,
+        "step_time": _percentiles(slowest),
+        "ranks": [r for r, _ in per_rank],
+    }
+
+def print_report(report, out):
+    """Human-readable summary of a run_benchmark report."""
+    print(f"\n--- Benchmark: {report['world_size']} ranks, global batch "
+          f"{report['global_batch']}, hook {report['comm_hook']}, "
+          f"{report['steps']} steps ---", file=out)
+    header = (f"{'Rank':<5} | {'Host':<16} | {'Samples/s':>10} | {'p50 ms':>8} | {'p99 ms':>8}"
+              f" | {'Data':>6} | {'Compute':>7} | {'AllRed':>6} | {'Optim':>6}")
+    print(header, file=out)
+    print("-" * len(header), file=out)
+    for r in report["ranks"]:
+        split = r["split"]
+        step = sum(split.values()) or 1.0
+        print(f"{r['rank']:<5} | {r['host'][:16]:<16} | {r['samples_per_sec']:>10.1f}"
+              f" | {r['step_time']['p50'] * 1e3:>8.2f} | {r['step_time']['p99'] * 1e3:>8.2f}"
+              + "".join(f" | {split[k] / step:>{w}.0%}" for k, w in
+                        (("data", 6), ("compute", 7), ("allreduce", 6), ("optimizer", 6))),
+              file=out)
+    print("-" * len(header), file=out)
+    st = report["step_time"]
+    print(f"Job: {report['samples_per_sec']:.1f} samples/s "
+          f"({report['samples_per_sec_per_rank']:.1f} per rank), step time "
+          f"p50 {st['p50'] * 1e3:.2f} ms, p90 {st['p90'] * 1e3:.2f} ms, "
+          f"p99 {st['p99'] * 1e3:.2f} ms, all-reduce payload "
+          f"{report['allreduce_bytes_per_step'] / 2**20:.2f} MB/step", file=out, flush=True)
+
+def save_report(report, path):
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
@@ -0,0 +1,110 @@
+"""
+checkpoint.py: Asynchronous, resumable checkpoints for mnist_ddp.py.
+
+save() copies the training state into memory and returns, and a background
+thread writes it to disk while training continues. The state is the model,
+the optimizer, the epoch and the sampler. Files are written under a
+temporary name and renamed into place, so a job killed mid-write never
+leaves a truncated checkpoint behind. Only the newest `keep` checkpoints
+are kept.
+"""
+import os
+import re
+import copy
+import threading
+import torch
+
+_NAME = re.compile(r"^ckpt-epoch(\d+)\.pt$")
+
+def _to_cpu(obj):
+    # Detached CPU copies of every tensor, so training can keep updating
+    # the live ones while the snapshot is written
+    if torch.is_tensor(obj):
+        return obj.detach().to("cpu", copy=True)
+    if isinstance(obj, dict):
+        return {k: _to_cpu(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(_to_cpu(v) for v in obj)
+    return copy.deepcopy(obj)
+
+class CheckpointManager:
+    """Writes checkpoints to `directory` in the background and finds the newest one."""
+
+    def __init__(self, directory, keep=3):
+        if keep < 1:
+            # Pruning would delete the checkpoint just written
+            raise ValueError(f"keep must be at least 1, got {keep}")
+        self.directory = directory
+        self.keep = keep
+        self._thread = None
+        self.error = None
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, epoch):
+        return os.path.join(self.directory, f"ckpt-epoch{epoch:05d}.pt")
+
+    def checkpoints(self):
+        """(epoch, path) of every finished checkpoint, newest first."""
+        found = []
+        for name in os.listdir(self.directory):
+            m = _NAME.match(name)
+            if m:
+                found.append((int(m.group(1)), os.path.join(self.directory, name)))
+        return sorted(found, reverse=True)
+
+    def save(self, model, optimizer, epoch, sampler=None):
+        """
+        Snapshots the state in memory and writes it on a background thread.
+        A previous write still in flight is waited for first, so at most
+        one snapshot is held besides the live model; its error, if any,
+        is returned.
+        """
+        error = self.wait()
+        state = {
+            "epoch": epoch,
+            "model": _to_cpu(model.state_dict()),
+            "optimizer": _to_cpu(optimizer.state_dict()),
+        }
+        if sampler is not None:
+            state["sampler"] = {"epoch": sampler.epoch, "seed": sampler.seed}
+        self._thread = threading.Thread(target=self._write, args=(state,), daemon=True)
+        self._thread.start()
+        return error
+
+    def _write(self, state):
+        final = self.path(state["epoch"])
+        tmp = final + ".tmp"
+        try:
+            with open(tmp, "wb") as f:
+                torch.save(state, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, final)
+            for _, old in self.checkpoints()[self.keep:]:
+                os.remove(old)
+        except Exception as e:
+            # Reported by wait(); training goes on with the older checkpoints
+            self.error = e
+
+    def wait(self):
+        """Blocks until the last write has finished. Returns its error, if any."""
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        error, self.error = self.error, None
+        return error
+
+    def latest(self):
+        """
+        (path, state) of the newest checkpoint that loads, or (None, None).
+        Unreadable files are skipped, falling back to older checkpoints.
+        """
+        for _, path in self.checkpoints():
+            try:
+                state = torch.load(path, map_location="cpu")
+            except Exception as e:
+                print(f"Skipping unreadable checkpoint {path}: {e}", flush=True)
+                continue
+            if {"epoch", "model", "optimizer"} <= set(state):
+                return path, state
+        return None, None
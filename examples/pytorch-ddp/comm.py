@@ -0,0 +1,60 @@
+"""
+comm.py: DDP gradient communication options for mnist_ddp.py.
+
+register_comm_hook installs one of the stock DDP communication hooks:
+fp16 or bf16 compression, or PowerSGD low-rank compression.
+allreduce_bytes estimates how much gradient data each optimizer step
+all-reduces with that hook, so the hooks, bucket sizes and accumulation
+can be compared on a given link.
+"""
+from torch.distributed.algorithms.ddp_comm_hooks import default_hooks, powerSGD_hook
+
+COMM_HOOKS = ("none", "fp16", "bf16", "powersgd")
+
+# PowerSGD only compresses a matrix when that shrinks it at least this much
+# (the hook's min_compression_rate default)
+_MIN_COMPRESSION_RATE = 2
+
+def register_comm_hook(model, name, powersgd_rank=1, powersgd_start_iter=10):
+    """
+    Registers the `name` hook (see COMM_HOOKS) on a DDP model. PowerSGD
+    all-reduces full gradients for the first `powersgd_start_iter`
+    optimizer steps, then rank-`powersgd_rank` factors with error feedback.
+    """
+    if name == "fp16":
+        model.register_comm_hook(None, default_hooks.fp16_compress_hook)
+    elif name == "bf16":
+        model.register_comm_hook(None, default_hooks.bf16_compress_hook)
+    elif name == "powersgd":
+        state = powerSGD_hook.PowerSGDState(
+            process_group=None,
+            matrix_approximation_rank=powersgd_rank,
+            start_powerSGD_iter=powersgd_start_iter,
+            min_compression_rate=_MIN_COMPRESSION_RATE,
+        )
+        model.register_comm_hook(state, powerSGD_hook.powerSGD_hook)
+    elif name != "none":
+        raise ValueError(f"unknown comm hook {name!r}, expected one of {COMM_HOOKS}")
+
+def allreduce_bytes(module, name, powersgd_rank=1):
+    """
+    Bytes of gradient payload one optimizer step all-reduces with the
+    `name` hook (PowerSGD after its warm-up). A ring all-reduce sends
+    and receives about twice this per rank.
+    """
+    total = 0
+    for p in module.parameters():
+        if not p.requires_grad:
+            continue
+        if name in ("fp16", "bf16"):
+            total += p.numel() * 2
+        elif name == "powersgd" and p.dim() > 1:
+            # Each gradient is viewed as an n x m matrix and sent as its
+            # P (n x rank) and Q (m x rank) factors when that is smaller
+            n = p.shape[0]
+            m = p.numel() // n
+            low_rank = (n + m) * powersgd_rank
+            total += (low_rank if low_rank * _MIN_COMPRESSION_RATE < n * m else n * m) * 4
+        else:
+            total += p.numel() * p.element_size()
+    return total
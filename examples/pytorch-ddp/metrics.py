@@ -0,0 +1,114 @@
+"""
+metrics.py: Low-overhead training metrics for mnist_ddp.py.
+
+StepMetrics adds each batch's loss and sample count to tensors on the
+training device, so no step waits on a .item() sync. Every `interval`
+steps all ranks all-reduce the sums together, which reports the loss
+over the whole global batch and the cluster-wide throughput.
+AsyncWriter hands the TensorBoard writes to a background thread that
+flushes in batches, so the training loop never waits on NFS.
+"""
+import time
+import queue
+import threading
+import torch
+import torch.distributed as dist
+
+class StepMetrics:
+    """
+    Loss and throughput accumulated on-device and all-reduced across ranks.
+    update() runs every step. reduce() is collective: every rank must call
+    it at the same step, as when should_reduce() is checked on each rank
+    with the same step count.
+    """
+
+    def __init__(self, device, interval=10):
+        self.device = device
+        self.interval = interval
+        # [sum of per-batch loss * batch size, samples]
+        self._sums = torch.zeros(2, dtype=torch.float64, device=device)
+        self._start = time.perf_counter()
+
+    def reset(self):
+        """Drops the sums and restarts the clock, e.g. at the start of an epoch."""
+        self._sums.zero_()
+        self._start = time.perf_counter()
+
+    def update(self, loss, batch_size):
+        self._sums[0] += loss.detach().double() * batch_size
+        self._sums[1] += batch_size
+
+    def should_reduce(self, step):
+        return self.interval > 0 and (step + 1) % self.interval == 0
+
+    def reduce(self):
+        """
+        All-reduces the sums since the last call and resets them. Returns
+        {"loss", "samples", "samples_per_sec"} for the whole job, or None
+        if no rank saw a batch. Throughput uses the slowest rank's time.
+        """
+        elapsed = time.perf_counter() - self._start
+        sums = self._sums.clone()
+        wall = torch.tensor([elapsed], dtype=torch.float64, device=self.device)
+        dist.all_reduce(sums, op=dist.ReduceOp.SUM)
+        dist.all_reduce(wall, op=dist.ReduceOp.MAX)
+        self.reset()
+
+        loss_sum, samples = sums.tolist()
+        if samples == 0:
+            return None
+        return {"loss": loss_sum / samples, "samples": int(samples),
+                "samples_per_sec": samples / max(wall.item(), 1e-9)}
+
+class AsyncWriter:
+    """
+    Queues TensorBoard writes for a background thread, which drains them
+    into `writer` and flushes at most every `flush_secs`. Without a
+    writer (ranks other than 0) every call is a no-op.
+    """
+
+    def __init__(self, writer, flush_secs=10.0):
+        self.writer = writer
+        self.flush_secs = flush_secs
+        self._queue = queue.Queue()
+        self._thread = None
+        if writer is not None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def __bool__(self):
+        return self.writer is not None
+
+    def add_scalar(self, tag, value, step):
+        if self.writer is not None:
+            self._queue.put(("add_scalar", tag, value, step))
+
+    def add_text(self, tag, text, step):
+        if self.writer is not None:
+            self._queue.put(("add_text", tag, text, step))
+
+    def _run(self):
+        last_flush = time.monotonic()
+        while True:
+            timeout = max(self.flush_secs - (time.monotonic() - last_flush), 0.0)
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = ()
+            if item is None:
+                break
+            if item:
+                method, *args = item
+                getattr(self.writer, method)(*args)
+            if time.monotonic() - last_flush >= self.flush_secs:
+                self.writer.flush()
+                last_flush = time.monotonic()
+        self.writer.flush()
+
+    def close(self):
+        """Writes everything still queued, then closes the writer."""
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+            self.writer.close()
@@ -1,5 +1,9 @@
 import os
+import sys
+import json
 import time
+import argparse
+from contextlib import nullcontext
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
@@ -9,6 +13,15 @@ import torch.distributed as dist
 from torch.nn.parallel import DistributedDataParallel as DDP
 from torch.utils.data.distributed import DistributedSampler
 from torch.utils.tensorboard import SummaryWriter
+from mnist_cache import CACHE_DTYPES, BatchLoader, CachedMNIST, build_cache, stage_cache
+from checkpoint import CheckpointManager
+from metrics import AsyncWriter, StepMetrics
+from comm import COMM_HOOKS, allreduce_bytes, register_comm_hook
+from benchmark import print_report, run_benchmark, save_report
+
+DATA_PATH = "/home/ubuntu/cluster_share/data"
+LOG_DIR = "/home/ubuntu/cluster_share/runs/mnist_experiment"
+CHECKPOINT_DIR = "/home/ubuntu/cluster_share/checkpoints/mnist"
 
 # ---------------------------------------------------------
 # CUSTOM LOGGER
@@ -20,9 +33,8 @@ def log_event(writer, step, message):
     
     # 2. Send to TensorBoard "Text" tab
     if writer:
-        # We use a markdown table format for cleaner looking logs
+        # Queued for the AsyncWriter thread, which flushes in batches
         writer.add_text("Training Logs", message, step)
-        writer.flush()
 
 def setup():
     if "SLURM_PROCID" in os.environ:
@@ -71,36 +83,122 @@ class Net(nn.Module):
         output = F.log_softmax(x, dim=1)
         return output
 
-def train(rank, model, device, train_loader, optimizer, epoch, writer):
+def train(rank, model, device, train_loader, optimizer, epoch, writer, metrics, accum_steps=1):
     model.train()
+    metrics.reset()
+    last = len(train_loader) - 1
+    optimizer.zero_grad()
     for batch_idx, (data, target) in enumerate(train_loader):
         data, target = data.to(device), target.to(device)
-        optimizer.zero_grad()
-        output = model(data)
-        loss = F.nll_loss(output, target)
-        loss.backward()
-        optimizer.step()
-        
-        # Calculate a global step for plotting
-        step = (epoch - 1) * len(train_loader) + batch_idx
 
-        # Only Rank 0 logs data
-        if rank == 0:
-            # Log heavily at the start (every batch for first 5), then every 2
-            if batch_idx < 5 or batch_idx % 2 == 0:
-                msg = f"Epoch: {epoch} [{batch_idx}/{len(train_loader)}] Loss: {loss.item():.6f}"
-                log_event(writer, step, msg)
-                
-                # Also log the scalar graph
-                writer.add_scalar('Training Loss', loss.item(), step)
+        # Gradient accumulation: the first micro-batches of each group only
+        # add to the local gradients (no_sync), the last one all-reduces the
+        # sum. Losses are scaled by the group size so the update matches one
+        # big batch; the group at the end of the epoch may be shorter.
+        group_start = batch_idx - batch_idx % accum_steps
+        group_size = min(accum_steps, last + 1 - group_start)
+        sync = batch_idx == group_start + group_size - 1
+        with nullcontext() if sync else model.no_sync():
+            output = model(data)
+            loss = F.nll_loss(output, target)
+            (loss / group_size).backward()
+        if sync:
+            optimizer.step()
+            optimizer.zero_grad()
+        # Accumulated on-device: no .item() sync per batch
+        metrics.update(loss, len(target))
+
+        # Every rank has the same number of batches (DistributedSampler pads),
+        # so all of them reach the collective reduce at the same batch
+        if metrics.should_reduce(batch_idx) or batch_idx == last:
+            stats = metrics.reduce()
+
+            # Calculate a global step for plotting
+            step = (epoch - 1) * len(train_loader) + batch_idx
+
+            # Only Rank 0 logs data: the loss over all ranks' batches
+            if rank == 0 and stats:
+                print(f"Epoch: {epoch} [{batch_idx + 1}/{len(train_loader)}] "
+                      f"Loss: {stats['loss']:.6f} | {stats['samples_per_sec']:.1f} samples/s",
+                      flush=True)
+                writer.add_scalar('Training Loss', stats['loss'], step)
+                writer.add_scalar('Throughput (samples/s)', stats['samples_per_sec'], step)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="MNIST training with PyTorch DDP")
+    parser.add_argument("--data-path", default=DATA_PATH,
+                        help=f"Shared dataset folder (default: {DATA_PATH})")
+    parser.add_argument("--dataset", choices=["torchvision", "cached"], default="torchvision",
+                        help="torchvision: datasets.MNIST with per-sample transforms, "
+                             "cached: preprocessed memory-mapped tensors on node-local disk")
+    parser.add_argument("--cache-dtype", choices=CACHE_DTYPES, default="uint8",
+                        help="Cached pixel type: uint8 (normalized per batch) or float32 "
+                             "(normalized once, 4x larger)")
+    parser.add_argument("--local-cache",
+                        default=os.path.join(os.environ.get("TMPDIR", "/tmp"), "mnist_cache"),
+                        help="Node-local folder the cache is staged to")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--epochs", type=int, default=999)
+    parser.add_argument("--comm-hook", choices=COMM_HOOKS, default="none",
+                        help="DDP gradient compression: fp16/bf16 halve the all-reduce, "
+                             "powersgd sends low-rank factors")
+    parser.add_argument("--powersgd-rank", type=int, default=1,
+                        help="PowerSGD matrix approximation rank")
+    parser.add_argument("--powersgd-start-iter", type=int, default=10,
+                        help="Optimizer steps with uncompressed all-reduce before PowerSGD starts")
+    parser.add_argument("--bucket-cap-mb", type=float, default=25,
+                        help="DDP gradient bucket size in MB (fewer, larger all-reduces when raised)")
+    parser.add_argument("--accum-steps", type=int, default=1,
+                        help="Micro-batches of --batch-size per optimizer step; "
+                             "only the last one all-reduces gradients")
+    parser.add_argument("--log-interval", type=int, default=10,
+                        help="Batches between all-reduced loss/throughput reports")
+    parser.add_argument("--log-dir", default=LOG_DIR,
+                        help=f"TensorBoard log folder (default: {LOG_DIR})")
+    parser.add_argument("--flush-secs", type=float, default=10.0,
+                        help="Seconds between TensorBoard flushes to the shared folder")
+    parser.add_argument("--checkpoint-dir", default=CHECKPOINT_DIR,
+                        help=f"Shared folder for checkpoints (default: {CHECKPOINT_DIR})")
+    parser.add_argument("--keep-checkpoints", type=int, default=3,
+                        help="Number of most recent checkpoints to keep")
+    parser.add_argument("--no-resume", action="store_true",
+                        help="Start from scratch even if a checkpoint exists")
+    bench = parser.add_argument_group("benchmark mode")
+    bench.add_argument("--benchmark-steps", type=int, default=0,
+                       help="Time this many optimizer steps and exit instead of training "
+                            "(no TensorBoard, no checkpoints)")
+    bench.add_argument("--warmup-steps", type=int, default=5,
+                       help="Untimed steps before the measured ones")
+    bench.add_argument("--benchmark-json", metavar="PATH",
+                       help="Write the JSON report here (default: print it)")
+    bench.add_argument("--profile-trace", metavar="DIR",
+                       help="Also record a torch.profiler trace per rank into DIR")
+    bench.add_argument("--profile-steps", type=int, default=10,
+                       help="Measured steps the profiler records")
+    args = parser.parse_args()
+    if args.accum_steps < 1:
+        parser.error("--accum-steps must be at least 1")
+    if args.flush_secs <= 0:
+        parser.error("--flush-secs must be positive")
+    if args.keep_checkpoints < 1:
+        parser.error("--keep-checkpoints must be at least 1, or nothing is left to resume from")
+    if args.benchmark_steps < 0 or args.warmup_steps < 0:
+        parser.error("--benchmark-steps and --warmup-steps must not be negative")
+    if args.profile_trace and not args.benchmark_steps:
+        parser.error("--profile-trace needs --benchmark-steps")
+    if args.profile_steps < 1:
+        parser.error("--profile-steps must be at least 1")
+    return args
 
 def main():
+    args = parse_args()
     setup()
     rank = dist.get_rank()
     world_size = dist.get_world_size()
     
     # Define data path
-    data_path = "/home/ubuntu/cluster_share/data"
+    data_path = args.data_path
+    shared_cache = os.path.join(data_path, "mnist_cache")
     device = torch.device("cpu")
 
     transform = transforms.Compose([
@@ -108,12 +206,13 @@ def main():
         transforms.Normalize((0.1307,), (0.3081,))
     ])
 
-    # Setup Writer (Only on Rank 0)
-    writer = None
+    # Setup Writer (Only on Rank 0; a no-op AsyncWriter elsewhere, and
+    # benchmark runs only print)
+    writer = AsyncWriter(None)
     if rank == 0:
-        log_dir = '/home/ubuntu/cluster_share/runs/mnist_experiment'
-        # We start with step 0
-        writer = SummaryWriter(log_dir)
+        if not args.benchmark_steps:
+            # We start with step 0
+            writer = AsyncWriter(SummaryWriter(args.log_dir), args.flush_secs)
         log_event(writer, 0, f"**Run Started** | Rank: {rank} | World Size: {world_size}")
 
     # ---------------------------------------------------------
@@ -123,7 +222,11 @@ def main():
         log_event(writer, 1, "Checking/Downloading dataset...")
         if not os.path.exists(data_path):
             os.makedirs(data_path)
-        datasets.MNIST(data_path, train=True, download=True, transform=transform)
+        if args.dataset == "cached":
+            # Decode + normalize once for every rank and epoch
+            build_cache(data_path, shared_cache, args.cache_dtype)
+        else:
+            datasets.MNIST(data_path, train=True, download=True, transform=transform)
         log_event(writer, 2, "Download complete. Releasing barrier.")
     
     # Barrier: Everyone waits here
@@ -135,39 +238,108 @@ def main():
     # ---------------------------------------------------------
     # DATA LOADER
     # ---------------------------------------------------------
-    dataset1 = datasets.MNIST(data_path, train=True, download=False, transform=transform)
-    sampler1 = DistributedSampler(dataset1, num_replicas=world_size, rank=rank)
-    train_loader = torch.utils.data.DataLoader(dataset1, batch_size=64, sampler=sampler1, num_workers=0)
+    if args.dataset == "cached":
+        # One process per node copies the cache off NFS; all ranks on the
+        # node then map the same local files
+        if int(os.environ.get("LOCAL_RANK", 0)) == 0:
+            stage_cache(shared_cache, args.local_cache, args.cache_dtype)
+        dist.barrier()
+        dataset1 = CachedMNIST(args.local_cache, args.cache_dtype)
+        sampler1 = DistributedSampler(dataset1, num_replicas=world_size, rank=rank)
+        train_loader = BatchLoader(dataset1, args.batch_size, sampler1)
+    else:
+        dataset1 = datasets.MNIST(data_path, train=True, download=False, transform=transform)
+        sampler1 = DistributedSampler(dataset1, num_replicas=world_size, rank=rank)
+        train_loader = torch.utils.data.DataLoader(dataset1, batch_size=args.batch_size,
+                                                   sampler=sampler1, num_workers=0)
     
     if rank == 0:
         log_event(writer, 4, "DataLoader ready.")
 
+    # ---------------------------------------------------------
+    # RESUME
+    # ---------------------------------------------------------
+    # Rank 0 picks the newest readable checkpoint (e.g. after Slurm requeued
+    # the job) and every rank loads that same file
+    checkpoints = None
+    if rank == 0 and not args.benchmark_steps:
+        checkpoints = CheckpointManager(args.checkpoint_dir, args.keep_checkpoints)
+    resume, state = [None], None
+    if checkpoints and not args.no_resume:
+        resume[0], state = checkpoints.latest()
+    dist.broadcast_object_list(resume, src=0)
+    if resume[0] and state is None:
+        state = torch.load(resume[0], map_location=device)
+
     # ---------------------------------------------------------
     # MODEL
     # ---------------------------------------------------------
     model = Net().to(device)
-    model = DDP(model)
+    if state:
+        model.load_state_dict(state["model"])
+    model = DDP(model, bucket_cap_mb=args.bucket_cap_mb)
+    register_comm_hook(model, args.comm_hook, args.powersgd_rank, args.powersgd_start_iter)
     optimizer = optim.Adadelta(model.parameters(), lr=1.0)
+    metrics = StepMetrics(device, args.log_interval)
+    start_epoch = 1
+    if state:
+        optimizer.load_state_dict(state["optimizer"])
+        if "sampler" in state:
+            sampler1.seed = state["sampler"]["seed"]
+        start_epoch = state["epoch"] + 1
+        del state
     
     if rank == 0:
+        if resume[0]:
+            log_event(writer, 5, f"Resumed from {resume[0]} at epoch {start_epoch}.")
+        payload = allreduce_bytes(model.module, args.comm_hook, args.powersgd_rank)
+        log_event(writer, 5, f"Gradient all-reduce: hook {args.comm_hook}, "
+                             f"{payload / 2**20:.2f} MB per optimizer step, "
+                             f"{payload / args.accum_steps / 2**20:.2f} MB per batch "
+                             f"(global batch {args.batch_size * args.accum_steps * world_size})")
         log_event(writer, 5, "Model initialized & DDP wrapped. Starting Training Loop...")
 
+    # ---------------------------------------------------------
+    # BENCHMARK
+    # ---------------------------------------------------------
+    if args.benchmark_steps:
+        report = run_benchmark(model, optimizer, train_loader, sampler1, device, args,
+                               allreduce_bytes(model.module, args.comm_hook, args.powersgd_rank))
+        if rank == 0:
+            print_report(report, sys.stdout)
+            if args.benchmark_json:
+                save_report(report, args.benchmark_json)
+                print(f"Report written to {args.benchmark_json}", flush=True)
+            else:
+                print(json.dumps(report, indent=2), flush=True)
+            writer.close()
+        cleanup()
+        return
+
     # ---------------------------------------------------------
     # TRAINING
     # ---------------------------------------------------------
-    for epoch in range(1, 1000):
+    for epoch in range(start_epoch, args.epochs + 1):
         sampler1.set_epoch(epoch)
         if rank == 0:
             log_event(writer, epoch*1000, f"Starting Epoch {epoch}")
             
-        train(rank, model, device, train_loader, optimizer, epoch, writer)
+        train(rank, model, device, train_loader, optimizer, epoch, writer, metrics,
+              args.accum_steps)
         
         if rank == 0:
             log_event(writer, (epoch+1)*1000, f"End of Epoch {epoch}. Saving checkpoint...")
             writer.add_scalar('Epoch', epoch, epoch)
-            torch.save(model.state_dict(), "/home/ubuntu/cluster_share/mnist_cnn.pt")
+            # Copied in memory here, written to disk by a background thread
+            # while the next epoch trains
+            error = checkpoints.save(model.module, optimizer, epoch, sampler1)
+            if error:
+                log_event(writer, (epoch+1)*1000, f"Previous checkpoint failed: {error}")
 
     if rank == 0:
+        error = checkpoints.wait()
+        if error:
+            log_event(writer, 999998, f"Final checkpoint failed: {error}")
         log_event(writer, 999999, "Training complete.")
         writer.close()
 
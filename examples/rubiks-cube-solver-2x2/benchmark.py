@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+"""
+benchmark.py: Reproducible performance benchmark for the solvers.
+Generates seeded scrambles at fixed optimal depths, runs every solver mode
+on them (the MPI solver locally through mpirun -np N) and records states/sec,
+time per BFS level, peak RSS, DB load time and time to solution. Results are
+written as JSON and can be checked against a stored baseline, in which case
+the exit status is 1 if any metric regressed past its threshold.
+
+    python3 benchmark.py --depths 6 8 10 --np 2 4
+    python3 benchmark.py --baseline bench_baseline.json --update-baseline
+    python3 benchmark.py --baseline bench_baseline.json
+"""
+import os
+import re
+import sys
+import json
+import time
+import shlex
+import signal
+import random
+import socket
+import argparse
+import platform
+import statistics
+import subprocess
+import threading
+
+from cube_utils import SOLVED_STATE, ALL_MOVES, apply_move, prepare_state
+from pattern_db import DIST_FILE, load_distance_table, get_distance
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# B / B' don't map the sticker layout onto itself (prepare_state rejects the
+# result), so scrambles are drawn from the other five faces.
+SCRAMBLE_MOVES = [m for m in ALL_MOVES if m[0] != 'B']
+
+# Solver command line (script, extra arguments) per benchmark mode
+MODES = {
+    "bfs": ("regular_solver.py", []),
+    "bfs-sym": ("regular_solver.py", ["--sym"]),
+    "bidir": ("regular_solver.py", ["--mode", "bidir"]),
+    "ida": ("regular_solver.py", ["--mode", "ida"]),
+    "table": ("regular_solver.py", ["--mode", "table"]),
+    "table-sym": ("regular_solver.py", ["--mode", "table", "--sym"]),
+    "mpi": ("mpi_solver.py", []),
+    "mpi-bidir": ("mpi_solver.py", ["--bidir"]),
+}
+DEFAULT_MODES = ["bfs", "bfs-sym", "ida", "table", "mpi"]
+# Modes launched through mpirun, once per --np value
+MPI_MODES = [m for m, (script, _) in MODES.items() if script == "mpi_solver.py"]
+# Largest optimal (QTM) distance of any 2x2 state
+MAX_DEPTH = 14
+
+# Metrics compared against the baseline: (higher is better, threshold option)
+METRICS = {
+    "time_to_solution": (False, "time"),
+    "states_per_sec": (True, "rate"),
+    "db_load_time": (False, "time"),
+    "peak_rss_kb": (False, "rss"),
+}
+
+# Solver output lines the timings are taken from. Color codes are stripped
+# first, in case a solver's output carries any.
+_ANSI = re.compile(r"\x1b\[[0-9;]*m")
+_SOLVE_START = re.compile(r"Solving Normalized State")
+_SOLVED = re.compile(r"\*\*\* SOLUTION FOUND \*\*\*")
+_LEVEL = re.compile(r"^\[(?:Step \d+\] Frontier Size|IDA\*\] Bound)")
+_LOADED = re.compile(r"loaded in ([\d.]+)s")
+_EXPLORED = re.compile(r"States Explored: (\d+)")
+_MOVES = re.compile(r"^Moves: (\d+)")
+
+def make_scramble(rng, depth, packed):
+    """
+    Random walk from solved that moves one step further from solved with
+    every move, so the scramble's optimal length is exactly `depth`.
+    Returns (sticker state, moves), or None if the walk got stuck.
+    """
+    state, moves, dist = SOLVED_STATE, [], 0
+    while dist < depth:
+        farther = []
+        for m in SCRAMBLE_MOVES:
+            nxt = apply_move(state, m)
+            if get_distance(packed, prepare_state(nxt)[0]) == dist + 1:
+                farther.append((m, nxt))
+        if not farther:
+            return None
+        m, state = rng.choice(farther)
+        moves.append(m)
+        dist += 1
+    return state, moves
+
+def generate_scrambles(depths, per_depth, seed, packed):
+    """`per_depth` distinct scrambles per optimal depth, reproducible from `seed`."""
+    rng = random.Random(seed)
+    scrambles = []
+    for depth in depths:
+        seen = set()
+        while len(seen) < per_depth:
+            found = make_scramble(rng, depth, packed)
+            if found is None or found[0] in seen:
+                continue
+            seen.add(found[0])
+            scrambles.append({"depth": depth, "moves": " ".join(found[1]),
+                              "state": " ".join(map(str, found[0]))})
+    return scrambles
+
+def build_command(mode, state, args, np_=None):
+    """Command line running one solver mode on one scramble."""
+    script, extra = MODES[mode]
+    cmd = [sys.executable, "-u", os.path.join(HERE, script)] + extra
+    if mode in MPI_MODES:
+        cmd = shlex.split(args.mpirun) + ["-np", str(np_)] + cmd + shlex.split(args.mpi_args)
+    return cmd + [state]
+
+def run_solver(cmd, timeout):
+    """
+    Runs one solve, timestamping every output line as it arrives.
+    Returns (exit code, [(seconds since launch, line)], peak RSS in KB).
+    The RSS is the largest of the solver and every process it waited for,
+    so under mpirun it is the largest rank.
+    """
+    t0 = time.perf_counter()
+    # Own session, so a timeout can kill mpirun together with its ranks
+    proc = subprocess.Popen(cmd, cwd=HERE, stdout=subprocess.PIPE,
+                            stderr=subprocess.STDOUT, text=True, start_new_session=True)
+    lines = []
+
+    def read():
+        for line in proc.stdout:
+            lines.append((time.perf_counter() - t0, _ANSI.sub("", line).rstrip("\n")))
+
+    # Output is read on a thread, so the deadline also holds for a solver
+    # that hangs without printing anything
+    reader = threading.Thread(target=read, daemon=True)
+    reader.start()
+    reader.join(timeout)
+    if reader.is_alive():
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        reader.join(5)
+        lines.append((time.perf_counter() - t0, f"timed out after {timeout:g}s"))
+    proc.stdout.close()
+    # wait4 instead of Popen.wait, for the resource usage of the run
+    _, status, usage = os.wait4(proc.pid, 0)
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    return proc.returncode, lines, usage.ru_maxrss
+
+def parse_run(lines):
+    """Extracts the metrics of one run from its timestamped output."""
+    result = {"db_load_time": None, "time_to_solution": None, "states_explored": None,
+              "states_per_sec": None, "length": None, "level_times": []}
+    start = end = None
+    marks = []
+    for t, line in lines:
+        if _SOLVE_START.search(line) and start is None:
+            start = t
+        elif _SOLVED.search(line) and end is None:
+            end = t
+        elif _LEVEL.search(line) and start is not None and end is None:
+            marks.append(t)
+        if m := _LOADED.search(line):
+            # MPI: every rank loads the DB; the slowest one holds up the start
+            result["db_load_time"] = max(result["db_load_time"] or 0.0, float(m.group(1)))
+        if m := _EXPLORED.search(line):
+            result["states_explored"] = int(m.group(1))
+        if m := _MOVES.search(line):
+            result["length"] = int(m.group(1))
+
+    if start is not None and end is not None:
+        result["time_to_solution"] = round(end - start, 6)
+        bounds = [start] + marks + [end]
+        result["level_times"] = [round(b - a, 6) for a, b in zip(bounds, bounds[1:])]
+        if result["states_explored"] is not None and end > start:
+            result["states_per_sec"] = round(result["states_explored"] / (end - start), 1)
+    return result
+
+def run_benchmark(args, scrambles):
+    """Runs every (mode, scramble) pair `args.repeat` times. Returns the run records."""
+    runs = []
+    targets = [(m, None) for m in args.modes if m not in MPI_MODES]
+    targets += [(m, n) for m in args.modes if m in MPI_MODES for n in args.np]
+
+    for mode, np_ in targets:
+        name = f"{mode}-np{np_}" if np_ else mode
+        for sc in scrambles:
+            for rep in range(args.repeat):
+                cmd = build_command(mode, sc["state"], args, np_)
+                t0 = time.perf_counter()
+                code, lines, rss = run_solver(cmd, args.timeout)
+                run = {"mode": name, "depth": sc["depth"], "scramble": sc["state"],
+                       "repeat": rep, "exit_code": code,
+                       "wall_time": round(time.perf_counter() - t0, 6), "peak_rss_kb": rss}
+                run.update(parse_run(lines))
+                if code != 0 or run["time_to_solution"] is None:
+                    run["error"] = lines[-1][1] if lines else f"exit code {code}"
+                elif run["length"] != sc["depth"]:
+                    run["error"] = f"non-optimal solution ({run['length']} moves)"
+                runs.append(run)
+
+                status = run.get("error") or (f"{run['time_to_solution']:.3f}s, "
+                                              f"{run['states_explored']} states")
+                print(f"[Bench] {name:<14} depth {sc['depth']:>2}: {status}",
+                      file=sys.stderr, flush=True)
+    return runs
+
+def summarize(runs):
+    """Median of every metric per mode and depth, over the successful runs."""
+    groups = {}
+    for run in runs:
+        if "error" not in run:
+            groups.setdefault(f"{run['mode']}/d{run['depth']}", []).append(run)
+
+    summary = {}
+    for key, group in sorted(groups.items()):
+        entry = {"runs": len(group)}
+        for metric in list(METRICS) + ["states_explored", "wall_time"]:
+            values = [r[metric] for r in group if r[metric] is not None]
+            entry[metric] = statistics.median(values) if values else None
+        levels = [r["level_times"] for r in group]
+        entry["level_times"] = [statistics.median(ts) for ts in zip(*levels)] if levels else []
+        summary[key] = entry
+    return summary
+
+def compare(summary, baseline, args):
+    """
+    Checks the summary against a baseline summary. Returns the list of
+    regressions as (key, metric, baseline value, current value, change).
+    Time metrics (and the rates of solves) below --min-time in both runs
+    are treated as noise.
+    """
+    thresholds = {"time": args.time_threshold, "rate": args.rate_threshold,
+                  "rss": args.rss_threshold}
+    regressions = []
+    for key, entry in summary.items():
+        base = baseline.get(key)
+        if base is None:
+            continue
+        for metric, (higher_better, kind) in METRICS.items():
+            old, new = base.get(metric), entry.get(metric)
+            if not old or new is None:
+                continue
+            # Rates of very short solves are as noisy as their times
+            spans = (old, new) if kind == "time" else \
+                (base.get("time_to_solution") or 0, entry.get("time_to_solution") or 0)
+            if kind != "rss" and max(spans) < args.min_time:
+                continue
+            change = (new - old) / old
+            if (-change if higher_better else change) > thresholds[kind]:
+                regressions.append((key, metric, old, new, change))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the 2x2 solvers")
+    parser.add_argument("--depths", type=int, nargs="+", default=[4, 6, 8, 10, 12],
+                        help="Optimal scramble depths to benchmark (default: 4 6 8 10 12)")
+    parser.add_argument("--per-depth", type=int, default=3,
+                        help="Scrambles per depth (default: 3)")
+    parser.add_argument("--seed", type=int, default=2024,
+                        help="Scramble generator seed (default: 2024)")
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per scramble")
+    parser.add_argument("--modes", nargs="+", choices=list(MODES), default=DEFAULT_MODES,
+                        help=f"Solver modes to run (default: {' '.join(DEFAULT_MODES)})")
+    parser.add_argument("--np", type=int, nargs="+", default=[2],
+                        help="MPI process counts for the mpi modes (default: 2)")
+    parser.add_argument("--mpirun", default="mpirun",
+                        help="MPI launcher command, e.g. 'mpirun --oversubscribe'")
+    parser.add_argument("--mpi-args", default="",
+                        help="Extra mpi_solver.py flags, e.g. '--steal --workers 2'")
+    parser.add_argument("--timeout", type=float, default=600, help="Seconds per run")
+    parser.add_argument("--output", default="bench_results.json",
+                        help="Results file (default: bench_results.json)")
+    parser.add_argument("--baseline", metavar="FILE",
+                        help="Compare against this results file; exit 1 on a regression")
+    parser.add_argument("--update-baseline", action="store_true",
+                        help="Store the results as the --baseline file instead of comparing")
+    parser.add_argument("--time-threshold", type=float, default=0.20,
+                        help="Allowed slowdown of time metrics (default: 0.20 = 20%%)")
+    parser.add_argument("--rate-threshold", type=float, default=0.20,
+                        help="Allowed drop in states/sec (default: 0.20)")
+    parser.add_argument("--rss-threshold", type=float, default=0.10,
+                        help="Allowed growth of peak RSS (default: 0.10)")
+    parser.add_argument("--min-time", type=float, default=0.05,
+                        help="Ignore times and rates of runs shorter than this many seconds "
+                             "(default: 0.05)")
+    args = parser.parse_args()
+    if args.update_baseline and not args.baseline:
+        parser.error("--update-baseline needs --baseline FILE")
+    if not all(1 <= d <= MAX_DEPTH for d in args.depths):
+        parser.error(f"depths must be between 1 and {MAX_DEPTH}")
+
+    # The full distance table gives every state's optimal depth
+    try:
+        packed = load_distance_table(os.path.join(HERE, DIST_FILE))
+    except FileNotFoundError:
+        print(f"Error: {DIST_FILE} missing. Run generate_db.py --mode table first.",
+              file=sys.stderr)
+        sys.exit(1)
+
+    scrambles = generate_scrambles(args.depths, args.per_depth, args.seed, packed)
+    runs = run_benchmark(args, scrambles)
+    summary = summarize(runs)
+    results = {
+        "meta": {"host": socket.gethostname(), "python": platform.python_version(),
+                 "cpus": os.cpu_count(), "seed": args.seed, "depths": args.depths,
+                 "per_depth": args.per_depth, "repeat": args.repeat,
+                 "mpi_args": args.mpi_args, "time": time.strftime("%Y-%m-%dT%H:%M:%S")},
+        "scrambles": scrambles,
+        "runs": runs,
+        "summary": summary,
+    }
+
+    out = args.baseline if args.update_baseline else args.output
+    with open(out, "w") as f:
+        json.dump(results, f, indent=2)
+
+    print(f"\n{'Mode/Depth':<20} | {'Solve (s)':<10} | {'States/s':<12} | "
+          f"{'DB Load (s)':<11} | {'Peak RSS (MB)':<13}")
+    print("-" * 78)
+    for key, e in summary.items():
+        fmt = lambda v, spec: format(v, spec) if v is not None else "-"
+        print(f"{key:<20} | {fmt(e['time_to_solution'], '<10.3f')} | "
+              f"{fmt(e['states_per_sec'], '<12.0f')} | {fmt(e['db_load_time'], '<11.3f')} | "
+              f"{e['peak_rss_kb'] / 1024:<13.1f}")
+    failed = sum("error" in r for r in runs)
+    print(f"\n{len(runs)} runs, {failed} failed. Results written to {out}")
+
+    if args.baseline and not args.update_baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["summary"]
+        regressions = compare(summary, baseline, args)
+        for key, metric, old, new, change in regressions:
+            print(f"REGRESSION {key} {metric}: {old:.4g} -> {new:.4g} ({change:+.1%})")
+        if regressions or failed:
+            sys.exit(1)
+        print(f"No regressions against {args.baseline}.")
+    elif failed:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -6,12 +6,13 @@ Verified Move Definitions to ensure geometric consistency.
 
 import sys
 import argparse
+import itertools
+from collections import deque
 
+import numpy as np
 import colorama
 from colorama import Back, Style
 
-colorama.init(autoreset=True)
-
 # 2x2 Cube Layout (24 integers)
 #       00 01
 #       02 03
@@ -55,11 +56,368 @@ for m, p in MOVES_BASE.items():
 
 def apply_move(state, move_name):
     return apply_perm(state, ALL_MOVES[move_name])
-	
+
+# --- Compact State Encoding ---
+# Corner slots as sticker-index triples: (U/D sticker, then clockwise).
+# The last slot (DLB, stickers 6/19/22) is the corner held fixed by the
+# restricted R/U/F move set, so only the first 7 slots are encoded.
+CORNER_SLOTS = [
+    (3, 12, 9),    # URF
+    (2, 8, 5),     # UFL
+    (0, 4, 17),    # ULB
+    (1, 16, 13),   # UBR
+    (21, 11, 14),  # DFR
+    (20, 7, 10),   # DLF
+    (23, 15, 18),  # DRB
+    (22, 19, 6),   # DLB (fixed)
+]
+NUM_FREE_CORNERS = 7
+
+N_PERM = 5040                # 7! corner permutations
+N_TWIST = 729                # 3^6 orientations (7th is implied)
+N_STATES = N_PERM * N_TWIST  # 3,674,160 fixed-corner states
+SOLVED_INDEX = 0
+
+# Sticker value -> (corner it belongs to, position within that corner)
+_STICKER_CORNER = {
+    sticker: (corner, pos)
+    for corner, slot in enumerate(CORNER_SLOTS)
+    for pos, sticker in enumerate(slot)
+}
+
+def rank_perm(perm):
+    """Lehmer-code rank of a permutation of range(n) in [0, n!)."""
+    n = len(perm)
+    rank = 0
+    for i in range(n):
+        smaller = sum(1 for x in perm[i + 1:] if x < perm[i])
+        rank = rank * (n - i) + smaller
+    return rank
+
+def unrank_perm(rank, n=NUM_FREE_CORNERS):
+    """Inverse of rank_perm."""
+    digits = [0] * n
+    for i in range(n - 1, -1, -1):
+        rank, digits[i] = divmod(rank, n - i)
+    available = list(range(n))
+    return [available.pop(d) for d in digits]
+
+def rank_twist(twist):
+    """Base-3 rank of the first 6 corner orientations (the 7th is implied)."""
+    rank = 0
+    for t in twist[:NUM_FREE_CORNERS - 1]:
+        rank = rank * 3 + t
+    return rank
+
+def unrank_twist(rank):
+    """Inverse of rank_twist. Restores the 7th orientation from the sum rule."""
+    twist = [0] * NUM_FREE_CORNERS
+    for i in range(NUM_FREE_CORNERS - 2, -1, -1):
+        rank, twist[i] = divmod(rank, 3)
+    twist[-1] = -sum(twist) % 3
+    return twist
+
+def state_to_cubies(state):
+    """
+    Splits a fixed-corner sticker tuple into (perm, twist) lists.
+    perm[i] is the corner sitting in slot i, twist[i] is which of the slot's
+    stickers shows that corner's U/D color.
+    """
+    if state[6] != 6 or state[19] != 19 or state[22] != 22:
+        raise ValueError("State invalid: Fixed corner (Values 6,19,22) not in place.")
+
+    perm, twist = [], []
+    for slot in CORNER_SLOTS[:NUM_FREE_CORNERS]:
+        try:
+            corner, pos = _STICKER_CORNER[state[slot[0]]]
+        except (KeyError, IndexError):
+            raise ValueError(f"State invalid: bad sticker at index {slot[0]}.")
+        o = -pos % 3
+        stickers = CORNER_SLOTS[corner]
+        if any(state[slot[j]] != stickers[(j - o) % 3] for j in range(3)):
+            raise ValueError(f"State invalid: corner at {slot} is not a real corner.")
+        perm.append(corner)
+        twist.append(o)
+
+    if sorted(perm) != list(range(NUM_FREE_CORNERS)) or sum(twist) % 3:
+        raise ValueError("State invalid: not reachable from the solved state.")
+    return perm, twist
+
+def cubies_to_state(perm, twist):
+    """Inverse of state_to_cubies."""
+    state = list(SOLVED_STATE)
+    for slot, corner, o in zip(CORNER_SLOTS, perm, twist):
+        stickers = CORNER_SLOTS[corner]
+        for j in range(3):
+            state[slot[j]] = stickers[(j - o) % 3]
+    return tuple(state)
+
+def state_to_index(state):
+    """Maps a fixed-corner sticker tuple to a dense integer in [0, N_STATES)."""
+    perm, twist = state_to_cubies(state)
+    return rank_perm(perm) * N_TWIST + rank_twist(twist)
+
+def index_to_state(index):
+    """Inverse of state_to_index."""
+    perm_rank, twist_rank = divmod(index, N_TWIST)
+    return cubies_to_state(unrank_perm(perm_rank), unrank_twist(twist_rank))
+
+# --- Move Transition Tables ---
+# Index-space moves are the restricted R/U/F set, which keeps the DLB corner
+# fixed. A move index is the position of the move in RESTRICTED_MOVES.
+RESTRICTED_MOVES = [m for m in ALL_MOVES if m[0] in ['R', 'U', 'F']]
+MOVE_INDEX = {m: i for i, m in enumerate(RESTRICTED_MOVES)}
+N_MOVES = len(RESTRICTED_MOVES)
+INVERSE_MOVE_INDEX = [MOVE_INDEX[get_inverse_move(m)] for m in RESTRICTED_MOVES]
+
+def _corner_move(move_name):
+    """Per free slot: (slot the corner comes from, twist shift)."""
+    perm = ALL_MOVES[move_name]
+    return [_STICKER_CORNER[perm[slot[0]]] for slot in CORNER_SLOTS[:NUM_FREE_CORNERS]]
+
+def _rank_perms(perms):
+    """Vectorized rank_perm over the rows of an (N, 7) array."""
+    n = perms.shape[1]
+    rank = np.zeros(len(perms), dtype=np.int64)
+    for i in range(n):
+        smaller = (perms[:, i + 1:] < perms[:, i:i + 1]).sum(axis=1)
+        rank = rank * (n - i) + smaller
+    return rank
+
+def _rank_twists(twists):
+    """Vectorized rank_twist over the rows of an (N, 7) array."""
+    rank = np.zeros(len(twists), dtype=np.int64)
+    for i in range(NUM_FREE_CORNERS - 1):
+        rank = rank * 3 + twists[:, i]
+    return rank
+
+def _build_coord_tables():
+    # itertools.permutations yields lexicographic order, i.e. rank order.
+    perms = np.array(list(itertools.permutations(range(NUM_FREE_CORNERS))))
+    twists = np.array([unrank_twist(r) for r in range(N_TWIST)])
+
+    perm_table = np.empty((N_PERM, N_MOVES), dtype=np.int32)
+    twist_table = np.empty((N_TWIST, N_MOVES), dtype=np.int32)
+    for m, name in enumerate(RESTRICTED_MOVES):
+        src, shift = map(np.array, zip(*_corner_move(name)))
+        perm_table[:, m] = _rank_perms(perms[:, src])
+        twist_table[:, m] = _rank_twists((twists[:, src] - shift) % 3)
+    return perm_table, twist_table
+
+# PERM_MOVE[perm_rank, move] / TWIST_MOVE[twist_rank, move] -> new rank.
+# A move acts on the two coordinates independently, so together they form
+# the full (N_STATES x N_MOVES) transition table at a fraction of its size.
+PERM_MOVE, TWIST_MOVE = _build_coord_tables()
+_PERM_MOVE_LIST = PERM_MOVE.tolist()
+_TWIST_MOVE_LIST = TWIST_MOVE.tolist()
+_MOVE_TABLE = None
+
+def apply_move_index(index, move):
+    """Scalar move on a state index (move is an index into RESTRICTED_MOVES)."""
+    perm_rank, twist_rank = divmod(index, N_TWIST)
+    return _PERM_MOVE_LIST[perm_rank][move] * N_TWIST + _TWIST_MOVE_LIST[twist_rank][move]
+
+def apply_moves_batch(states, moves=None):
+    """
+    Expands an array of state indices by every move in `moves` (indices into
+    RESTRICTED_MOVES, default all of them) with two table gathers.
+    Returns an int64 array of shape (len(states), len(moves)).
+    """
+    states = np.asarray(states, dtype=np.int64)
+    moves = np.arange(N_MOVES) if moves is None else np.asarray(moves)
+    perm_rank, twist_rank = np.divmod(states, N_TWIST)
+    return (PERM_MOVE[perm_rank[:, None], moves].astype(np.int64) * N_TWIST
+            + TWIST_MOVE[twist_rank[:, None], moves])
+
+# --- Canonical Move Sequences (pruning) ---
+# In QTM an optimal sequence never undoes its last move and never turns a
+# face three times in a row; U' U' reaches the same state as U U, so only
+# the clockwise double is kept. A sequence code sums up the tail of the
+# moves so far: codes 0-5 are "last move m", HALF_TURN_SEQ + f is "face f
+# just turned twice clockwise" and SEQ_START is the empty sequence.
+# PRUNE_NEXT[code][m] is the code after move m, or -1 if m is pruned.
+N_FACES = N_MOVES // 2
+HALF_TURN_SEQ = N_MOVES
+SEQ_START = HALF_TURN_SEQ + N_FACES
+N_SEQ = SEQ_START + 1
+
+def _build_prune_table():
+    table = np.full((N_SEQ, N_MOVES), -1, dtype=np.int8)
+    for code in range(N_SEQ):
+        last_face = code // 2 if code < N_MOVES else code - HALF_TURN_SEQ
+        for m in range(N_MOVES):
+            if code == SEQ_START or m // 2 != last_face:
+                table[code, m] = m
+            elif code == m and m % 2 == 0:
+                table[code, m] = HALF_TURN_SEQ + m // 2
+    return table
+
+PRUNE_NEXT = _build_prune_table()
+PRUNE_NEXT_LIST = PRUNE_NEXT.tolist()
+# Moves allowed after each code, and the move that produced each code
+ALLOWED_MOVES = [tuple(m for m in range(N_MOVES) if row[m] >= 0) for row in PRUNE_NEXT_LIST]
+SEQ_MOVE = list(range(N_MOVES)) + [2 * f for f in range(N_FACES)] + [0]
+
+def get_move_table():
+    """
+    Full (N_STATES, N_MOVES) int32 transition table (~88 MB), built on first
+    use. Only worth it when the whole state space is swept repeatedly.
+    """
+    global _MOVE_TABLE
+    if _MOVE_TABLE is None:
+        _MOVE_TABLE = (PERM_MOVE[:, None, :] * N_TWIST
+                       + TWIST_MOVE[None, :, :]).reshape(N_STATES, N_MOVES)
+    return _MOVE_TABLE
+
+# --- Whole-Cube Rotations & Symmetry ---
+# Rotations are sticker permutations like moves. x = R + L', y = U + D'.
+ROTATION_BASE = {
+    'x': apply_perm(ALL_MOVES['R'], ALL_MOVES["L'"]),
+    'y': apply_perm(ALL_MOVES['U'], ALL_MOVES["D'"]),
+}
+
+def apply_cube_rotation(state, rot_axis):
+    """Whole-cube rotation ('x' or 'y'); other values leave the state as is."""
+    if rot_axis in ROTATION_BASE:
+        return apply_perm(state, ROTATION_BASE[rot_axis])
+    return state
+
+def _build_rotations():
+    # BFS over x/y from the identity: all 24 orientations, each with its
+    # shortest rotation sequence (the same one a BFS from any state finds).
+    rotations = {SOLVED_STATE: []}
+    queue = deque([SOLVED_STATE])
+    while queue:
+        curr = queue.popleft()
+        for rot in ['x', 'y']:
+            nxt = apply_cube_rotation(curr, rot)
+            if nxt not in rotations:
+                rotations[nxt] = rotations[curr] + [rot]
+                queue.append(nxt)
+    return list(rotations.items())
+
+# ROTATIONS[k] = (sticker permutation, rotation sequence)
+ROTATIONS = _build_rotations()
+# Sticker 6 sitting at position p is brought home by ROTATIONS[ROTATION_BY_POS6[p]]
+ROTATION_BY_POS6 = {perm[6]: k for k, (perm, _) in enumerate(ROTATIONS)}
+
+def normalize_to_fixed_corner(state):
+    """
+    Whole-cube rotation placing the Back-Down-Left corner stickers
+    (Values 6, 19, 22) at indices [6, 19, 22], found by table lookup.
+    Returns (normalized state, rotation sequence).
+    """
+    try:
+        perm, path = ROTATIONS[ROTATION_BY_POS6[state.index(6)]]
+    except (ValueError, KeyError):
+        raise ValueError("State invalid: Fixed corner (Values 6,19,22) not found together.")
+    norm = apply_perm(state, perm)
+    if norm[19] != 19 or norm[22] != 22:
+        raise ValueError("State invalid: Fixed corner (Values 6,19,22) not found together.")
+    return norm, list(path)
+
+def parse_state(text):
+    """Parses 24 space/comma separated integers into a state tuple."""
+    state = tuple(map(int, text.replace(",", " ").split()))
+    if len(state) != 24:
+        raise ValueError(f"Expected 24 integers, got {len(state)}.")
+    return state
+
+def prepare_state(state):
+    """
+    Normalizes a raw state and converts it to a state index (the solvers
+    search on dense indices, see state_to_index).
+    Returns (start index, setup rotation). Raises ValueError if invalid.
+    """
+    norm_state, setup_moves = normalize_to_fixed_corner(state)
+    return state_to_index(norm_state), setup_moves
+
+# Left-right mirror: swaps the L and R faces and flips every face.
+MIRROR = (1, 0, 3, 2, 13, 12, 15, 14, 9, 8, 11, 10,
+          5, 4, 7, 6, 17, 16, 19, 18, 21, 20, 23, 22)
+
+def _invert_perm(perm):
+    inv = [0] * len(perm)
+    for i, p in enumerate(perm):
+        inv[p] = i
+    return tuple(inv)
+
+# The 48 cube symmetries (24 rotations, each with and without the mirror).
+# Symmetry g maps a state s to g s g^-1: new[i] = SYM_RELABEL[g][s[SYM_PERM[g][i]]].
+# It preserves the distance to solved, so symmetric states can share one entry.
+_SYM_PERMS = [perm for perm, _ in ROTATIONS] + [apply_perm(perm, MIRROR) for perm, _ in ROTATIONS]
+SYM_PERM = np.array(_SYM_PERMS, dtype=np.intp)
+SYM_RELABEL = np.array([_invert_perm(p) for p in _SYM_PERMS], dtype=np.uint8)
+N_SYMS = len(_SYM_PERMS)
+
+_ROT_BY_POS6 = np.array([ROTATIONS[ROTATION_BY_POS6[p]][0] for p in range(24)], dtype=np.intp)
+_PERMS = np.array(list(itertools.permutations(range(NUM_FREE_CORNERS))), dtype=np.intp)
+_TWISTS = np.array([unrank_twist(r) for r in range(N_TWIST)], dtype=np.intp)
+_SLOTS = np.array(CORNER_SLOTS, dtype=np.intp)
+_CORNER_OF = np.array([_STICKER_CORNER[i][0] for i in range(24)], dtype=np.intp)
+_POS_IN_CORNER = np.array([_STICKER_CORNER[i][1] for i in range(24)], dtype=np.intp)
+
+def indices_to_stickers(indices):
+    """Vectorized index_to_state: (N,) state indices -> (N, 24) uint8 stickers."""
+    perm_rank, twist_rank = np.divmod(np.asarray(indices, dtype=np.int64), N_TWIST)
+    perms, twists = _PERMS[perm_rank], _TWISTS[twist_rank]
+    stickers = np.empty((len(perms), 24), dtype=np.uint8)
+    stickers[:, list(CORNER_SLOTS[-1])] = CORNER_SLOTS[-1]
+    for i, slot in enumerate(CORNER_SLOTS[:NUM_FREE_CORNERS]):
+        for j in range(3):
+            stickers[:, slot[j]] = _SLOTS[perms[:, i], (j - twists[:, i]) % 3]
+    return stickers
+
+def stickers_to_indices(stickers):
+    """Vectorized state_to_index for (N, 24) valid fixed-corner sticker rows."""
+    stickers = np.asarray(stickers, dtype=np.intp)
+    ud = stickers[:, _SLOTS[:NUM_FREE_CORNERS, 0]]
+    perms = _CORNER_OF[ud]
+    twists = -_POS_IN_CORNER[ud] % 3
+    return _rank_perms(perms) * N_TWIST + _rank_twists(twists)
+
+def canonical_indices(indices, chunk=4096):
+    """
+    Symmetry-class representative (smallest index over all 48 symmetries)
+    for each state index. Each symmetric image is re-normalized so the fixed
+    corner is home again, keeping representatives in the fixed-corner space.
+    """
+    indices = np.asarray(indices, dtype=np.int64)
+    out = np.empty(len(indices), dtype=np.int64)
+    relabel_base = (np.arange(N_SYMS) * 24)[None, :, None]
+    for start in range(0, len(indices), chunk):
+        stickers = indices_to_stickers(indices[start:start + chunk])
+        # (n, 48, 24): conjugate by every symmetry at once
+        images = SYM_RELABEL.ravel()[stickers[:, SYM_PERM] + relabel_base]
+        pos6 = np.argmax(images == 6, axis=2)
+        images = np.take_along_axis(images, _ROT_BY_POS6[pos6], axis=2)
+        ranks = stickers_to_indices(images.reshape(-1, 24)).reshape(len(stickers), N_SYMS)
+        out[start:start + chunk] = ranks.min(axis=1)
+    return out
+
+def canonical_index(index):
+    """Scalar canonical_indices."""
+    return int(canonical_indices([index])[0])
+
+_colors_ready = False
+
+def init_colors():
+    """
+    Sets up colorama for the colored output. Called only where colors are
+    printed: colorama.init registers an atexit color reset, which would
+    otherwise end up in the output of every tool importing this module
+    (e.g. after the JSON lines of mpi_solver --batch).
+    """
+    global _colors_ready
+    if not _colors_ready:
+        colorama.init(autoreset=True)
+        _colors_ready = True
+
 def visualize_cube(state):
     """
     Prints a visual representation of the 2x2 cube state using colorama.
     """
+    init_colors()
     
     # Define Block Style (2 spaces for a square look)
     BLOCK = "  "
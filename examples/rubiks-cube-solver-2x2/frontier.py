@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+frontier.py: Array-backed BFS frontiers with parent pointers.
+Every level stores, per node, its state index, the position of its parent in
+the previous level and the move code that reached it (9 bytes per node).
+Move codes are cube_utils sequence codes: they name the move and also
+drive canonical move pruning when the node is expanded.
+Paths are only rebuilt, by walking parents back, once a solution is found.
+The backward side of a bidirectional search is an arena too, rooted at
+the solved state or at the outer layer of the DB (see backward_path).
+Chunks of a level are expanded by expand_chunk, inline or on a local
+process pool (ExpansionPool).
+"""
+import multiprocessing
+from array import array
+from collections import deque
+
+import numpy as np
+from cube_utils import (
+    RESTRICTED_MOVES, MOVE_INDEX, N_MOVES, SEQ_MOVE, SEQ_START, PRUNE_NEXT,
+    apply_move_index, apply_moves_batch, canonical_indices, get_inverse_move
+)
+from pattern_db import NO_MOVE
+
+class FrontierArena:
+    """
+    Per-level arenas for a search rooted at one state index, or at every
+    state of `roots`. Without a root, level 0 starts empty (a rank that
+    does not own the start state in a partitioned search).
+    """
+
+    def __init__(self, root=None, roots=None):
+        if roots is None:
+            roots = [] if root is None else [root]
+        roots = np.asarray(roots, dtype=np.uint32)
+        self.states = [array('I', roots.tobytes())]
+        self.parents = [array('i', [-1]) * len(roots)]
+        self.moves = [array('B', [SEQ_START]) * len(roots)]
+
+    @property
+    def depth(self):
+        """Index of the newest level (the root is level 0)."""
+        return len(self.states) - 1
+
+    @property
+    def frontier(self):
+        """States of the newest level."""
+        return self.states[-1]
+
+    def new_level(self):
+        """Opens an empty level and returns its (states, parents, move codes) arrays."""
+        self.states.append(array('I'))
+        self.parents.append(array('i'))
+        self.moves.append(array('B'))
+        return self.states[-1], self.parents[-1], self.moves[-1]
+
+    def path_to(self, level, pos):
+        """Move names from the root to node `pos` of `level`."""
+        moves = []
+        while level > 0:
+            moves.append(RESTRICTED_MOVES[SEQ_MOVE[self.moves[level][pos]]])
+            pos = self.parents[level][pos]
+            level -= 1
+        moves.reverse()
+        return moves
+
+    def nbytes(self):
+        """Total bytes held by all levels."""
+        return sum(
+            a.itemsize * len(a)
+            for level in zip(self.states, self.parents, self.moves)
+            for a in level
+        )
+
+def backward_path(meet_state, root_to_meet, backward_db=None):
+    """
+    Moves from meet_state to solved, for a state reached by the backward
+    side of a bidirectional search. root_to_meet are the move names that
+    led from a backward root to meet_state: undone in reverse they lead
+    back to the root, which is the solved state or, with a DB, a state
+    whose path to solved the DB stores.
+    """
+    moves = [get_inverse_move(m) for m in reversed(root_to_meet)]
+    state = meet_state
+    for m in moves:
+        state = apply_move_index(state, MOVE_INDEX[m])
+    while backward_db is not None:
+        entry = backward_db.get(state)
+        if not entry or entry[0] is None:
+            break
+        state, move = entry
+        moves.append(get_inverse_move(move))
+    return moves
+
+def expand_chunk(db, states, codes, owner, start, size=1, use_sym=False):
+    """
+    Expands a chunk of frontier states (with their move codes) by every
+    canonical move and checks the children against the DB. Parents are
+    global handles (position * size + owner), positions counted from start.
+    Returns (hit, explored, children, parents, next codes, keys): hit is
+    (state, move, owner, position) of the first child found in the DB, else None;
+    keys are the symmetry classes with use_sym, else None.
+    """
+    children = apply_moves_batch(states)
+    next_codes = PRUNE_NEXT[codes]
+    allowed = next_codes >= 0
+    hits = np.flatnonzero(allowed.ravel() & (db.lookup(children.ravel()) != NO_MOVE))
+    if len(hits):
+        i, m = divmod(int(hits[0]), N_MOVES)
+        explored = int(np.count_nonzero(allowed.ravel()[:hits[0] + 1]))
+        return (int(children[i, m]), m, owner, start + i), explored, None, None, None, None
+
+    parents = np.arange(start, start + len(states), dtype=np.int64) * size + owner
+    parents = np.broadcast_to(parents[:, None], children.shape)
+    children = children[allowed].astype(np.uint32)
+    keys = canonical_indices(children).astype(np.uint32) if use_sym else None
+    return (None, int(np.count_nonzero(allowed)), children,
+            parents[allowed].astype(np.int32), next_codes[allowed].astype(np.uint8), keys)
+
+# Pool workers see the DB through this global, set once per worker
+_worker_db = None
+
+def _init_expander(db):
+    global _worker_db
+    _worker_db = db
+
+def _expand_job(args):
+    return expand_chunk(_worker_db, *args)
+
+class ExpansionPool:
+    """
+    Local worker processes for expand_chunk. Workers are forked, so they
+    inherit the memory-mapped DB: every process on the node reads the same
+    page-cache pages and no extra copy of the DB is made. Workers never
+    call MPI; the parent keeps all communication. Under MPI, create the
+    pool before MPI is initialized: forking an initialized MPI process is
+    unsafe on several transports (e.g. OpenIB, UCX).
+    """
+
+    def __init__(self, db, workers):
+        self.workers = workers
+        ctx = multiprocessing.get_context("fork")
+        self._pool = ctx.Pool(workers, initializer=_init_expander, initargs=(db,))
+
+    def map_chunks(self, jobs):
+        """
+        Yields expand_chunk results for an iterable of argument tuples, in
+        order. Jobs are pulled lazily in the calling thread and at most two
+        per worker are in flight, so the caller can stop early.
+        """
+        jobs = iter(jobs)
+        pending = deque()
+        while True:
+            while len(pending) < 2 * self.workers:
+                args = next(jobs, None)
+                if args is None:
+                    break
+                pending.append(self._pool.apply_async(_expand_job, (args,)))
+            if not pending:
+                return
+            yield pending.popleft().get()
+
+    def close(self):
+        self._pool.terminate()
+        self._pool.join()
@@ -1,43 +1,59 @@
 #!/usr/bin/env python3
 """
 generate_db.py: Pre-computes states to Depth 8 (QTM).
+Writes the binary halfway.pdb by default; can also build a complete
+distance-to-solved table, the legacy halfway.pkl, or convert a pickle.
+The parallel mode spreads each level over a process pool and checkpoints
+every finished depth so an interrupted job can resume. The mpi mode spreads
+it over every rank of an MPI job, each writing its own DB shard.
 """
+import os
 import pickle
+import argparse
+import multiprocessing
 from collections import deque
-from cube_utils import SOLVED_STATE, ALL_MOVES, apply_move
+from multiprocessing import shared_memory
+
+import numpy as np
+from cube_utils import (
+    SOLVED_STATE, RESTRICTED_MOVES, apply_move, state_to_index,
+    N_STATES, N_MOVES, SOLVED_INDEX, MOVE_INDEX, INVERSE_MOVE_INDEX, apply_moves_batch,
+    canonical_indices, SEQ_START, ALLOWED_MOVES, PRUNE_NEXT, PRUNE_NEXT_LIST
+)
+from pattern_db import (
+    DIST_FILE, MOVES_FILE, PDB_FILE, SYM_DIST_FILE, UNKNOWN_DIST, NO_MOVE, SOLVED_MARK,
+    pack_distances, write_pattern_db, write_pattern_shard, shard_size
+)
 
 DEPTH_LIMIT = 8
 DB_FILE = "halfway.pkl"
+CHECKPOINT_FILE = "halfway.ckpt.npz"
 
-MOVES_RESTRICTED = {
-    k: v for k, v in ALL_MOVES.items() 
-    if k[0] in ['R', 'F', 'U']
-}
-
-def generate():
+def generate(depth_limit=DEPTH_LIMIT, path=DB_FILE):
     # Visited stores { State : (Parent_State, Move_From_Parent) }
     visited = {SOLVED_STATE: (None, None)}
-    queue = deque([(SOLVED_STATE, 0)])
+    queue = deque([(SOLVED_STATE, 0, SEQ_START)])
     
-    print(f"Generating Database to Depth {DEPTH_LIMIT}...")
+    print(f"Generating Database to Depth {depth_limit}...")
     
     count = 0
     depth_counts = {}
     
     while queue:
-        curr, depth = queue.popleft()
+        curr, depth, code = queue.popleft()
         
         # Track stats
         depth_counts[depth] = depth_counts.get(depth, 0) + 1
         
-        if depth >= DEPTH_LIMIT:
+        if depth >= depth_limit:
             continue
             
-        for m, _ in MOVES_RESTRICTED.items():
-            nxt = apply_move(curr, m)
+        # Canonical sequences only (see cube_utils.PRUNE_NEXT)
+        for m in ALLOWED_MOVES[code]:
+            nxt = apply_move(curr, RESTRICTED_MOVES[m])
             if nxt not in visited:
-                visited[nxt] = (curr, m)
-                queue.append((nxt, depth + 1))
+                visited[nxt] = (curr, RESTRICTED_MOVES[m])
+                queue.append((nxt, depth + 1, PRUNE_NEXT_LIST[code][m]))
                 #print(nxt)
                 #print(visited[nxt])
 				
@@ -50,9 +66,362 @@ def generate():
     print(f"Total Unique States: {len(visited)}")
     print("States per depth:", dict(sorted(depth_counts.items())))
     
-    with open(DB_FILE, "wb") as f:
+    with open(path, "wb") as f:
         pickle.dump(visited, f)
-    print(f"Saved to {DB_FILE}")
+    print(f"Saved to {path}")
+
+def bfs_levels(depth_limit=None, with_moves=False):
+    """
+    Level-synchronous BFS over state indices. Each level is expanded with one
+    apply_moves_batch call, so there is no per-state Python work. Every
+    frontier state carries its move code, so moves pruned by PRUNE_NEXT
+    are never looked up.
+    Returns (dist, moves, depth_counts); moves[i] is the move that brings
+    state i one step closer to solved (None unless with_moves).
+    """
+    dist = np.full(N_STATES, UNKNOWN_DIST, dtype=np.uint8)
+    moves = np.full(N_STATES, NO_MOVE, dtype=np.uint8) if with_moves else None
+    inverse = np.array(INVERSE_MOVE_INDEX, dtype=np.uint8)
+
+    dist[SOLVED_INDEX] = 0
+    frontier = np.array([SOLVED_INDEX], dtype=np.int64)
+    codes = np.array([SEQ_START], dtype=np.uint8)
+    depth = 0
+    depth_counts = {0: 1}
+
+    while len(frontier) and (depth_limit is None or depth < depth_limit):
+        children = apply_moves_batch(frontier)
+        next_codes = PRUNE_NEXT[codes]
+        allowed = next_codes >= 0
+        applied = np.broadcast_to(np.arange(N_MOVES), allowed.shape)[allowed]
+        children, next_codes = children[allowed], next_codes[allowed]
+        new = dist[children] == UNKNOWN_DIST
+        # Keep the first occurrence of each new child (and the move reaching it)
+        children, first = np.unique(children[new], return_index=True)
+        depth += 1
+        dist[children] = depth
+        if with_moves:
+            moves[children] = inverse[applied[new][first]]
+
+        frontier, codes = children, next_codes[new][first].astype(np.uint8)
+        if len(frontier):
+            depth_counts[depth] = len(frontier)
+            print(f"Depth {depth}: {len(frontier)} states", flush=True)
+
+    return dist, moves, depth_counts
+
+def generate_table(depth_limit=None, with_moves=False):
+    """
+    Writes the packed distance table and, optionally, the move-byte table.
+    """
+    limit_str = depth_limit if depth_limit is not None else "full"
+    print(f"Generating Distance Table (Depth: {limit_str})...")
+    dist, moves, depth_counts = bfs_levels(depth_limit, with_moves)
+
+    print("\nGeneration Complete.")
+    print(f"Total Unique States: {sum(depth_counts.values())}")
+    print("States per depth:", depth_counts)
+
+    np.save(DIST_FILE, pack_distances(dist))
+    print(f"Saved to {DIST_FILE}")
+    if with_moves:
+        np.save(MOVES_FILE, moves)
+        print(f"Saved to {MOVES_FILE}")
+
+def generate_sym_table(depth_limit=None, path=SYM_DIST_FILE):
+    """
+    Distance table with one entry per symmetry class (up to 48 states each).
+    The BFS runs over class representatives: children are canonicalized
+    before dedup, so each level holds ~1/48th of the states.
+    """
+    limit_str = depth_limit if depth_limit is not None else "full"
+    print(f"Generating Symmetry-Reduced Distance Table (Depth: {limit_str})...")
+
+    seen = np.zeros(N_STATES, dtype=bool)
+    seen[SOLVED_INDEX] = True
+    frontier = np.array([SOLVED_INDEX], dtype=np.int64)
+    levels = [frontier]
+    depth = 0
+
+    while len(frontier) and (depth_limit is None or depth < depth_limit):
+        children = np.unique(apply_moves_batch(frontier).ravel())
+        children = np.unique(canonical_indices(children))
+        frontier = children[~seen[children]]
+        seen[frontier] = True
+        depth += 1
+        if len(frontier):
+            levels.append(frontier)
+            print(f"Depth {depth}: {len(frontier)} classes", flush=True)
+
+    classes = np.concatenate(levels)
+    dist = np.concatenate([np.full(len(l), d, dtype=np.uint8) for d, l in enumerate(levels)])
+    order = np.argsort(classes)
+
+    print("\nGeneration Complete.")
+    print(f"Total Symmetry Classes: {len(classes)}")
+    with open(path, "wb") as f:
+        np.savez(f, classes=classes[order].astype(np.uint32), dist=dist[order])
+    print(f"Saved to {path}")
+
+def generate_pdb(depth_limit=DEPTH_LIMIT, path=PDB_FILE):
+    """Writes the binary halfway DB (every state within depth_limit)."""
+    print(f"Generating Database to Depth {depth_limit}...")
+    _, moves, depth_counts = bfs_levels(depth_limit, with_moves=True)
+    moves[SOLVED_INDEX] = SOLVED_MARK
+
+    count = write_pattern_db(moves, max(depth_counts), path)
+    print("\nGeneration Complete.")
+    print(f"Total Unique States: {count}")
+    print("States per depth:", depth_counts)
+    print(f"Saved to {path}")
+
+# --- Parallel, Resumable Generation ---
+# Each state is owned by partition (index % workers). A level runs in two
+# pool phases: expand every frontier partition and bucket the unseen
+# children by owner, then let each owner dedup its bucket and record it in
+# the shared dist/moves arrays. Owners write disjoint indices, so no locks.
+_shared = {}
+
+def _attach_shared(dist_name, moves_name):
+    """Pool initializer: maps the shared dist/moves arrays into the worker."""
+    for key, name in (("dist", dist_name), ("moves", moves_name)):
+        shm = shared_memory.SharedMemory(name=name)
+        _shared[key] = (shm, np.ndarray(N_STATES, dtype=np.uint8, buffer=shm.buf))
+
+def _expand_partition(args):
+    (frontier, codes), workers = args
+    dist = _shared["dist"][1]
+    children = apply_moves_batch(frontier)
+    next_codes = PRUNE_NEXT[codes]
+    allowed = next_codes >= 0
+    applied = np.broadcast_to(np.arange(N_MOVES, dtype=np.uint8), children.shape)
+    children, applied, next_codes = children[allowed], applied[allowed], next_codes[allowed]
+    new = dist[children] == UNKNOWN_DIST
+    children, applied, next_codes = children[new], applied[new], next_codes[new]
+    owner = children % workers
+    return [(children[owner == w], applied[owner == w], next_codes[owner == w])
+            for w in range(workers)]
+
+def _claim_partition(args):
+    children, applied, codes, depth = args
+    dist, moves = _shared["dist"][1], _shared["moves"][1]
+    children, first = np.unique(children, return_index=True)
+    dist[children] = depth
+    moves[children] = np.array(INVERSE_MOVE_INDEX, dtype=np.uint8)[applied[first]]
+    return children, codes[first].astype(np.uint8)
+
+def _save_checkpoint(path, depth, dist, moves):
+    """Atomically replaces the checkpoint with the state after `depth`."""
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        np.savez(f, depth=depth, dist=dist, moves=moves)
+    os.replace(tmp, path)
+
+def generate_parallel(depth_limit=DEPTH_LIMIT, workers=None, path=PDB_FILE,
+                      checkpoint=CHECKPOINT_FILE):
+    """
+    Writes the binary halfway DB using a process pool, saving a checkpoint
+    after every completed depth and resuming from it if one exists.
+    """
+    workers = workers or os.cpu_count()
+    shms = [shared_memory.SharedMemory(create=True, size=N_STATES) for _ in range(2)]
+    try:
+        dist = np.ndarray(N_STATES, dtype=np.uint8, buffer=shms[0].buf)
+        moves = np.ndarray(N_STATES, dtype=np.uint8, buffer=shms[1].buf)
+
+        if os.path.exists(checkpoint):
+            with np.load(checkpoint) as ckpt:
+                depth = int(ckpt["depth"])
+                dist[:] = ckpt["dist"]
+                moves[:] = ckpt["moves"]
+            print(f"Resuming from checkpoint {checkpoint} (Depth {depth} complete).")
+        else:
+            dist[:] = UNKNOWN_DIST
+            moves[:] = NO_MOVE
+            dist[SOLVED_INDEX] = 0
+            moves[SOLVED_INDEX] = SOLVED_MARK
+            depth = 0
+
+        print(f"Generating Database to Depth {depth_limit} with {workers} workers...")
+        # Move codes aren't checkpointed: a resumed level is expanded unpruned
+        frontier = np.flatnonzero(dist == depth)
+        parts = [(p, np.full(len(p), SEQ_START, dtype=np.uint8))
+                 for p in (frontier[frontier % workers == w] for w in range(workers))]
+
+        with multiprocessing.Pool(workers, initializer=_attach_shared,
+                                  initargs=(shms[0].name, shms[1].name)) as pool:
+            while depth < depth_limit and any(len(p) for p, _ in parts):
+                buckets = pool.map(_expand_partition, [(p, workers) for p in parts])
+                jobs = [
+                    (np.concatenate([b[w][0] for b in buckets]),
+                     np.concatenate([b[w][1] for b in buckets]),
+                     np.concatenate([b[w][2] for b in buckets]),
+                     depth + 1)
+                    for w in range(workers)
+                ]
+                parts = pool.map(_claim_partition, jobs)
+                depth += 1
+
+                level_size = sum(len(p) for p, _ in parts)
+                if level_size:
+                    print(f"Depth {depth}: {level_size} states", flush=True)
+                _save_checkpoint(checkpoint, depth, dist, moves)
+
+        counts = np.bincount(dist, minlength=UNKNOWN_DIST + 1)[:UNKNOWN_DIST]
+        depth_counts = {d: int(c) for d, c in enumerate(counts) if c}
+
+        count = write_pattern_db(moves, max(depth_counts), path)
+        print("\nGeneration Complete.")
+        print(f"Total Unique States: {count}")
+        print("States per depth:", depth_counts)
+        print(f"Saved to {path}")
+    finally:
+        for shm in shms:
+            shm.close()
+            shm.unlink()
+
+    # No level may have been checkpointed (e.g. --depth 0)
+    if os.path.exists(checkpoint):
+        os.remove(checkpoint)
+
+# --- Distributed Generation (MPI) ---
+# Run under mpirun. State i is owned by rank i % size, which keeps the move
+# bytes of its states in a dense local array (its future shard). Every level
+# each rank expands its own frontier and sends the children to their owners
+# with one Alltoallv; owners dedup against their array. No rank ever holds
+# more than its share of the state space.
+EDGE = np.dtype([("state", "<u4"), ("move", "u1"), ("code", "u1")])
+
+def generate_mpi(depth_limit=DEPTH_LIMIT, path=PDB_FILE):
+    """Writes the binary halfway DB as one shard per MPI rank."""
+    from mpi4py import MPI
+    from mpi_utils import exchange_candidates
+
+    comm = MPI.COMM_WORLD
+    rank, size = comm.Get_rank(), comm.Get_size()
+    log = print if rank == 0 else (lambda *a, **k: None)
+    inverse = np.array(INVERSE_MOVE_INDEX, dtype=np.uint8)
+
+    local = np.full(shard_size(rank, size), NO_MOVE, dtype=np.uint8)
+    frontier = np.empty(0, dtype=np.int64)
+    codes = np.empty(0, dtype=np.uint8)
+    if SOLVED_INDEX % size == rank:
+        local[SOLVED_INDEX // size] = SOLVED_MARK
+        frontier = np.array([SOLVED_INDEX], dtype=np.int64)
+        codes = np.array([SEQ_START], dtype=np.uint8)
+
+    log(f"Generating Database to Depth {depth_limit} on {size} ranks...")
+    depth = 0
+    depth_counts = {0: 1}
+    sent_bytes = 0
+    while depth < depth_limit:
+        children = apply_moves_batch(frontier)
+        next_codes = PRUNE_NEXT[codes]
+        allowed = next_codes >= 0
+        edges = np.empty(int(np.count_nonzero(allowed)), dtype=EDGE)
+        edges["state"] = children[allowed]
+        edges["move"] = np.broadcast_to(np.arange(N_MOVES), allowed.shape)[allowed]
+        edges["code"] = next_codes[allowed]
+        # Drop own duplicates before sending
+        _, first = np.unique(edges["state"], return_index=True)
+        edges = edges[np.sort(first)]
+
+        incoming, sent = exchange_candidates(comm, edges, edges["state"] % size)
+        sent_bytes += sent
+
+        # Owner side: keep the first arrival of each state not seen yet
+        states = incoming["state"].astype(np.int64)
+        new = local[states // size] == NO_MOVE
+        _, first = np.unique(states[new], return_index=True)
+        incoming = incoming[new][first]
+        frontier = incoming["state"].astype(np.int64)
+        codes = incoming["code"]
+        local[frontier // size] = inverse[incoming["move"]]
+
+        level_size = comm.allreduce(len(frontier), op=MPI.SUM)
+        if level_size == 0:
+            break
+        depth += 1
+        depth_counts[depth] = level_size
+        log(f"Depth {depth}: {level_size} states", flush=True)
+
+    count = write_pattern_shard(local, rank, size, depth, path)
+    total = comm.reduce(count, op=MPI.SUM, root=0)
+    total_sent = comm.reduce(sent_bytes, op=MPI.SUM, root=0)
+    log("\nGeneration Complete.")
+    log(f"Total Unique States: {total}")
+    log("States per depth:", depth_counts)
+    log(f"Bytes Exchanged: {total_sent}")
+    log(f"Saved {size} shards to {path}.shard*")
+
+def convert_pickle(pkl_path=DB_FILE, path=PDB_FILE):
+    """Converts a legacy {state: (parent, move)} pickle into the binary DB."""
+    print(f"Converting {pkl_path} -> {path}...")
+    with open(pkl_path, "rb") as f:
+        visited = pickle.load(f)
+
+    moves = np.full(N_STATES, NO_MOVE, dtype=np.uint8)
+    for state, (parent, move) in visited.items():
+        idx = state_to_index(state)
+        if parent is None:
+            moves[idx] = SOLVED_MARK
+        else:
+            moves[idx] = INVERSE_MOVE_INDEX[MOVE_INDEX[move]]
+
+    # Depth of the DB = longest parent chain
+    def chain_length(state):
+        n = 0
+        while visited[state][0] is not None:
+            state = visited[state][0]
+            n += 1
+        return n
+    max_depth = max(chain_length(s) for s in visited)
+
+    count = write_pattern_db(moves, max_depth, path)
+    print(f"Converted {count} states (depth {max_depth}). Saved to {path}")
 
 if __name__ == "__main__":
-    generate()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="2x2 Pattern Database Generator")
+    parser.add_argument("--mode", choices=["pdb", "parallel", "mpi", "table", "pickle"],
+                        default="pdb",
+                        help="pdb: binary halfway.pdb, parallel: halfway.pdb over a process "
+                             "pool with per-depth checkpoints, mpi: one halfway.pdb shard per "
+                             "rank (run under mpirun), table: packed distance table, "
+                             "pickle: legacy halfway.pkl")
+    parser.add_argument("--depth", type=int, default=None,
+                        help=f"Depth limit (default: {DEPTH_LIMIT}, full for table)")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="parallel mode: pool size (default: all cores)")
+    parser.add_argument("--output", default=None,
+                        help=f"Output path (default: {PDB_FILE}, or {DB_FILE} for pickle, "
+                             f"{SYM_DIST_FILE} for table --sym; table without --sym "
+                             f"always writes {DIST_FILE})")
+    parser.add_argument("--checkpoint", default=CHECKPOINT_FILE,
+                        help="parallel mode: checkpoint file to save to and resume from")
+    parser.add_argument("--moves", action="store_true",
+                        help="table mode: also write the move-byte table")
+    parser.add_argument("--sym", action="store_true",
+                        help="table mode: store one entry per symmetry class instead")
+    parser.add_argument("--convert", metavar="PKL",
+                        help="Convert an existing pickle DB to halfway.pdb and exit")
+    args = parser.parse_args()
+    if args.mode == "table" and not args.sym and args.output and not args.convert:
+        # The plain table is two files at fixed paths the solvers load
+        parser.error(f"--output is not supported with --mode table; it writes "
+                     f"{DIST_FILE} (and {MOVES_FILE} with --moves)")
+    depth = args.depth if args.depth is not None else DEPTH_LIMIT
+
+    if args.convert:
+        convert_pickle(args.convert, args.output or PDB_FILE)
+    elif args.mode == "table" and args.sym:
+        generate_sym_table(args.depth, args.output or SYM_DIST_FILE)
+    elif args.mode == "table":
+        generate_table(args.depth, args.moves)
+    elif args.mode == "pickle":
+        generate(depth, args.output or DB_FILE)
+    elif args.mode == "mpi":
+        generate_mpi(depth, args.output or PDB_FILE)
+    elif args.mode == "parallel":
+        generate_parallel(depth, args.workers, args.output or PDB_FILE, args.checkpoint)
+    else:
+        generate_pdb(depth, args.output or PDB_FILE)
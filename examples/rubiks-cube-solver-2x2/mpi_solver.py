@@ -2,47 +2,31 @@
 """
 mpi_solver.py: Distributed 2x2 Cube Solver using MPI.
 Refactored to prevent deadlocks and ensure statistics printing.
+With --batch, solves a stream of scrambles with one DB load per rank.
 """
+import mpi4py
+# MPI is initialized in main(), after the --workers pool is forked: forking
+# an initialized MPI process is unsafe on several transports
+mpi4py.rc.initialize = False
+mpi4py.rc.finalize = True
 from mpi4py import MPI
-import pickle
 import sys
+import json
+import time
 import argparse
-from collections import deque
-from cube_utils import ALL_MOVES, apply_move, get_inverse_move
-
-DB_FILE = "halfway.pkl"
-
-# --- Rotation & Normalization Logic ---
-def apply_cube_rotation(state, rot_axis):
-    if rot_axis == 'y':
-        s = apply_move(state, 'U')
-        return apply_move(s, "D'")
-    elif rot_axis == 'x':
-        s = apply_move(state, 'R')
-        return apply_move(s, "L'")
-    return state
-
-def normalize_to_fixed_corner(state):
-    def is_normalized(s):
-        return (s[6] == 6 and s[19] == 19 and s[22] == 22)
-
-    if is_normalized(state):
-        return state, []
-
-    queue = deque([(state, [])])
-    visited = {state}
-    
-    while queue:
-        curr, path = queue.popleft()
-        for rot in ['x', 'y']:
-            nxt = apply_cube_rotation(curr, rot)
-            if nxt not in visited:
-                if is_normalized(nxt):
-                    return nxt, path + [rot]
-                visited.add(nxt)
-                queue.append((nxt, path + [rot]))
-    
-    raise ValueError("State invalid: Fixed corner (Values 6,19,22) not found together.")
+import numpy as np
+from cube_utils import (
+    RESTRICTED_MOVES, SOLVED_INDEX, SEQ_MOVE, PRUNE_NEXT, get_inverse_move,
+    apply_moves_batch, canonical_index, parse_state, prepare_state
+)
+from frontier import FrontierArena, ExpansionPool, backward_path, expand_chunk
+from mpi_utils import (
+    CANDIDATE, CANDIDATE_SYM, owner_rank, exchange_candidates, pack_candidates, StreamExchange
+)
+from pattern_db import PDB_FILE, NO_MOVE, open_pattern_db
+from profiler import PhaseProfiler, TimedDB, write_chrome_trace, print_summary
+
+DB_FILE = PDB_FILE
 
 def reconstruct_full_path(meet_state, forward_path, backward_db):
     full_path = list(forward_path)
@@ -59,50 +43,660 @@ def reconstruct_full_path(meet_state, forward_path, backward_db):
         
     return full_path + back_moves
 
-def main():
-    # --- MPI INIT ---
-    comm = MPI.COMM_WORLD
+def trace_forward_path(comm, arena, level, owner, pos):
+    """
+    Collective walk from node `pos` of `level` on rank `owner` back to the
+    root. Parent pointers are global handles (pos * size + rank), so each
+    step is one broadcast from the rank holding that node.
+    """
+    rank, size = comm.Get_rank(), comm.Get_size()
+    moves = []
+    while level > 0:
+        info = None
+        if rank == owner:
+            info = (arena.moves[level][pos], arena.parents[level][pos])
+        code, handle = comm.bcast(info, root=owner)
+        moves.append(RESTRICTED_MOVES[SEQ_MOVE[code]])
+        pos, owner = divmod(handle, size)
+        level -= 1
+    moves.reverse()
+    return moves
+
+class MeetNotices:
+    """
+    Asynchronous stop signal. A rank that meets the DB Isends a notice to
+    every other rank; the others poll a standing Irecv between chunks and
+    abandon the rest of the level. drain() consumes every notice before
+    the search returns so none leaks into the next search.
+    """
+    TAG = 77
+
+    def __init__(self, comm):
+        self.comm = comm
+        self.buf = np.empty(4, dtype=np.int64)
+        self.req = comm.Irecv(self.buf, source=MPI.ANY_SOURCE, tag=self.TAG)
+        self.received = 0
+        self.sends = []
+        self.announced = False
+
+    def announce(self, meet):
+        self.meet = meet.copy()
+        rank = self.comm.Get_rank()
+        self.sends = [self.comm.Isend(self.meet, dest=r, tag=self.TAG)
+                      for r in range(self.comm.Get_size()) if r != rank]
+        self.announced = True
+
+    def stopped(self):
+        """True once any other rank has announced a meet."""
+        if self.req is not None and self.req.Test():
+            self.received += 1
+            self.req = None
+        return self.req is None
+
+    def drain(self, announcers):
+        """Receives the notices of all `announcers` ranks (collective count)."""
+        expected = announcers - self.announced
+        if self.req is not None:
+            if expected > 0:
+                self.req.Wait()
+                self.received += 1
+            else:
+                self.req.Cancel()
+                self.req.Wait()
+            self.req = None
+        while self.received < expected:
+            self.comm.Recv(self.buf, source=MPI.ANY_SOURCE, tag=self.TAG)
+            self.received += 1
+        MPI.Request.Waitall(self.sends)
+
+class ChunkQueue:
+    """
+    Hands out frontier chunks as (owner rank, start position, states, codes).
+    Statically each rank walks its own frontier. With steal=True every
+    rank's chunk cursor, frontier and move codes are exposed as RMA
+    windows; a rank that runs out claims chunks from the others with an
+    atomic Fetch_and_op on their cursor and fetches the states with Get,
+    so fast nodes pick up extra slices of slow nodes' frontiers.
+    """
+
+    def __init__(self, comm, frontier, codes, sizes, chunk, steal=False):
+        self.comm = comm
+        self.rank = comm.Get_rank()
+        self.frontier = frontier
+        self.codes = codes
+        self.sizes = sizes
+        self.chunk = chunk
+        self.steal = steal and len(sizes) > 1 # nothing to steal from alone
+        self.stolen = 0
+        self.cursor = np.zeros(1, dtype=np.int64)
+        self.victims = [(self.rank + i) % len(sizes) for i in range(len(sizes) if self.steal else 1)]
+        if self.steal:
+            self.cursor_win = MPI.Win.Create(self.cursor, disp_unit=8, comm=comm)
+            self.frontier_win = MPI.Win.Create(frontier, disp_unit=4, comm=comm)
+            self.codes_win = MPI.Win.Create(codes, disp_unit=1, comm=comm)
+
+    def _claim(self, target):
+        if not self.steal:
+            start = int(self.cursor[0])
+            self.cursor[0] += self.chunk
+            return start
+        step = np.array([self.chunk], dtype=np.int64)
+        start = np.empty(1, dtype=np.int64)
+        self.cursor_win.Lock(target, MPI.LOCK_SHARED)
+        self.cursor_win.Fetch_and_op([step, MPI.INT64_T], [start, MPI.INT64_T],
+                                     target, 0, MPI.SUM)
+        self.cursor_win.Unlock(target)
+        return int(start[0])
+
+    def __iter__(self):
+        for target in self.victims:
+            while True:
+                start = self._claim(target)
+                n = min(self.chunk, int(self.sizes[target]) - start)
+                if n <= 0:
+                    break
+                if target == self.rank:
+                    yield (target, start, self.frontier[start:start + n],
+                           self.codes[start:start + n])
+                    continue
+                states = np.empty(n, dtype=np.uint32)
+                codes = np.empty(n, dtype=np.uint8)
+                self.frontier_win.Lock(target, MPI.LOCK_SHARED)
+                self.frontier_win.Get([states, MPI.UINT32_T], target,
+                                      target=(start, n, MPI.UINT32_T))
+                self.frontier_win.Unlock(target)
+                self.codes_win.Lock(target, MPI.LOCK_SHARED)
+                self.codes_win.Get([codes, MPI.UINT8_T], target,
+                                   target=(start, n, MPI.UINT8_T))
+                self.codes_win.Unlock(target)
+                self.stolen += 1
+                yield target, start, states, codes
+
+    def close(self):
+        """Collective when stealing: frees the windows."""
+        if self.steal:
+            self.cursor_win.Free()
+            self.frontier_win.Free()
+            self.codes_win.Free()
+
+def distributed_search(comm, start_state, backward_db, use_sym=False, log=print,
+                       chunk=4096, steal=False, pool=None, prof=None, pipeline=False):
+    """
+    Collective forward BFS: every rank must call it. start_state only matters
+    on rank 0, which broadcasts it.
+    The visited set and the frontier are hash-partitioned: every state (or
+    symmetry class with use_sym) belongs to owner_rank(key). Each rank
+    expands its share of the frontier in chunks (see ChunkQueue), skipping
+    non-canonical move sequences, drops its own duplicate children, sends
+    the rest to their owners with one all-to-all exchange and dedups only
+    the children it owns. A meet is announced to all ranks at once (see
+    MeetNotices), so nobody finishes the level in vain. With a local
+    ExpansionPool, the rank's chunks are expanded on all cores of its node.
+    With pipeline=True the level's children are streamed to their owners
+    chunk by chunk instead (see StreamExchange), overlapping the network
+    with expansion and dedup.
+    Frontiers only travel as packed NumPy buffers (uppercase MPI calls).
+    Rank 0 just coordinates termination. With a PhaseProfiler, every phase
+    of every step is timed on every rank.
+    Returns (solution, states explored by this rank, bytes sent by this
+    rank); solution is only set on rank 0 and is None if the search is
+    exhausted.
+    """
+    rank = comm.Get_rank()
+    size = comm.Get_size()
+    local_state_count = 0 # Stat tracking
+    local_bytes = 0
+    if prof is None:
+        prof = PhaseProfiler(rank, enabled=False)
+    prof.begin_search()
+    # Inline expansion can time its DB lookups separately
+    expand_db = TimedDB(backward_db, prof) if prof.enabled and pool is None else backward_db
+
+    with prof.phase("bcast"):
+        start_state = comm.bcast(start_state, root=0)
+
+    # Check if start is already in DB (every rank holds the DB)
+    if start_state in backward_db:
+        if rank == 0:
+            log("[Manager] Start state found in DB.")
+            return reconstruct_full_path(start_state, [], backward_db), 0, 0
+        return None, 0, 0
+
+    # --- 2. Setup: the start state lives on its owner only ---
+    # Parents are global handles pos * size + rank into the previous level
+    start_key = canonical_index(start_state) if use_sym else start_state
+    local_visited = set()
+    if owner_rank(start_key, size) == rank:
+        arena = FrontierArena(start_state)
+        local_visited.add(start_key)
+    else:
+        arena = FrontierArena()
+    record_type = CANDIDATE_SYM if use_sym else CANDIDATE
+    notices = MeetNotices(comm)
+
+    def admit(incoming):
+        """
+        Dedups received candidates against this rank's share of the
+        visited set and appends the new ones to the open level.
+        """
+        keys = incoming["key"] if use_sym else incoming["state"]
+        _, first = np.unique(keys, return_index=True)
+        first.sort()
+        keys = keys[first].tolist()
+        kept = incoming[first[[key not in local_visited for key in keys]]]
+        local_visited.update(keys)
+        for arr, field in zip(new_level, ("state", "parent", "move")):
+            arr.frombytes(np.ascontiguousarray(kept[field]).tobytes())
+
+    # --- 3. Synchronous BFS Loop ---
+    step = 0
+    sizes = np.empty(size, dtype=np.int64)
+    while True:
+        # --- A. TERMINATION CHECK ---
+        prof.begin_step(step)
+        with prof.phase("allgather"):
+            comm.Allgather(np.array([len(arena.frontier)], dtype=np.int64), sizes)
+        total = int(sizes.sum())
+        if total == 0:
+            notices.drain(0)
+            return None, local_state_count, local_bytes
+        if rank == 0:
+            log(f"[Step {step}] Frontier Size: {total}")
+
+        # --- B. CHUNKED EXPANSION (vectorized per chunk) ---
+        # Restricted Move Set (R, U, F) keeps us in fixed-corner space, and
+        # the pruning table drops moves that undo or triple-turn a face.
+        # Meet report: (state, move, parent rank, parent position), -1 if none
+        meet = np.full(4, -1, dtype=np.int64)
+        frontier = np.frombuffer(arena.frontier, dtype=np.uint32)
+        codes = np.frombuffer(arena.moves[step], dtype=np.uint8)
+        with prof.phase("expand") as info:
+            queue = ChunkQueue(comm, frontier, codes, sizes, chunk, steal)
+            jobs = ((states, state_codes, owner, start, size, use_sym)
+                    for owner, start, states, state_codes in queue)
+            # With a pool, this rank's chunks are spread over the node's cores
+            if pool is not None:
+                results = pool.map_chunks(jobs)
+            else:
+                results = (expand_chunk(expand_db, *job) for job in jobs)
+            parts = []
+            explored_before = local_state_count
+            if pipeline:
+                stream = StreamExchange(comm, record_type)
+                new_level = arena.new_level()
+            for hit, explored, *part in results:
+                local_state_count += explored
+                if hit:
+                    meet[:] = hit
+                    notices.announce(meet)
+                    break
+                if pipeline:
+                    # Send this chunk's children while the next one expands;
+                    # arrived batches are deduped (step E) right away
+                    records, keys = pack_candidates([part], record_type, use_sym)
+                    admit(stream.send(records, owner_rank(keys.astype(np.int64), size)))
+                    for batch in stream.poll():
+                        admit(batch)
+                else:
+                    parts.append(part)
+                if notices.stopped():
+                    break
+            queue.close()
+            info["explored"] = local_state_count - explored_before
+        if pipeline:
+            # Batches still in flight (even after a meet, so none is left over)
+            with prof.phase("exchange") as info:
+                for batch in stream.finish():
+                    admit(batch)
+                info["sent"] = stream.bytes_sent
+                info["received"] = stream.bytes_received
+            local_bytes += stream.bytes_sent
+
+        # --- C. TERMINATION DECISION (Rank 0) ---
+        # decision: chosen meet + number of ranks that announced one
+        with prof.phase("decide"):
+            all_meets = np.empty((size, 4), dtype=np.int64) if rank == 0 else None
+            comm.Gather(meet, all_meets, root=0)
+            decision = np.full(5, -1, dtype=np.int64)
+            if rank == 0:
+                found = all_meets[all_meets[:, 0] >= 0]
+                if len(found):
+                    decision[:4] = found[0]
+                decision[4] = len(found)
+            comm.Bcast(decision, root=0)
+        if decision[0] >= 0:
+            notices.drain(int(decision[4]))
+            meet_state, m, owner, pos = (int(x) for x in decision[:4])
+            with prof.phase("trace"):
+                forward_path = trace_forward_path(comm, arena, step, owner, pos)
+            if rank == 0:
+                forward_path.append(RESTRICTED_MOVES[m])
+                sol = reconstruct_full_path(meet_state, forward_path, backward_db)
+                return sol, local_state_count, local_bytes
+            return None, local_state_count, local_bytes
+
+        # --- D. ALL-TO-ALL EXCHANGE: route every child to its owner ---
+        if pipeline:
+            sent = stream.bytes_sent # already counted
+        else:
+            with prof.phase("dedup"):
+                # Local dedup first: each child is sent at most once per rank
+                records, keys = pack_candidates(parts, record_type, use_sym)
+                owners = owner_rank(keys.astype(np.int64), size)
+            with prof.phase("exchange") as info:
+                incoming, sent = exchange_candidates(comm, records, owners)
+                # Candidates this rank routed to itself never touch the network
+                info["sent"] = sent
+                info["received"] = (len(incoming) - int(np.count_nonzero(owners == rank))) \
+                    * record_type.itemsize
+            # --- E. LOCAL DEDUP against this rank's share of the visited set ---
+            with prof.phase("dedup"):
+                new_level = arena.new_level()
+                admit(incoming)
+            local_bytes += sent
+
+        with prof.phase("reduce"):
+            step_bytes = comm.reduce(sent, op=MPI.SUM, root=0)
+            stolen = comm.reduce(queue.stolen, op=MPI.SUM, root=0)
+        if rank == 0:
+            log(f"[Step {step}] Exchanged {step_bytes} bytes "
+                f"({record_type.itemsize} B/candidate)"
+                + (f", {stolen} chunks stolen" if steal else "")
+                + (" (streamed)" if pipeline else ""))
+        step += 1
+
+def bidirectional_search(comm, start_state, backward_db=None, back_roots=None, log=print,
+                         prof=None):
+    """
+    Collective meet-in-the-middle BFS (see regular_solver.bidirectional_search).
+    Each step grows the side with the smaller total frontier by one whole
+    level. Both sides are partitioned with the same owner_rank, so the
+    forward and backward visits of a state land on the same rank, and its
+    owner finds every meet while it dedups the children it received.
+    Without a DB the backward side starts at the solved state. With one,
+    it starts at back_roots (the DB's outer layer) split by owner, and
+    forward children are also checked against the DB before they are sent.
+    Returns (solution, states explored by this rank, bytes sent by this
+    rank); solution is only set on rank 0 and is None if the search is
+    exhausted.
+    """
     rank = comm.Get_rank()
     size = comm.Get_size()
+    local_state_count = 0
+    local_bytes = 0
+    if prof is None:
+        prof = PhaseProfiler(rank, enabled=False)
+    prof.begin_search()
+
+    with prof.phase("bcast"):
+        start_state = comm.bcast(start_state, root=0)
+    if backward_db is not None and start_state in backward_db:
+        if rank == 0:
+            log("[Manager] Start state found in DB.")
+            return reconstruct_full_path(start_state, [], backward_db), 0, 0
+        return None, 0, 0
+    if backward_db is None and start_state == SOLVED_INDEX:
+        return ([] if rank == 0 else None), 0, 0
+
+    # Visited maps: state -> (level, position) in this rank's share of a side
+    forward, forward_seen = FrontierArena(), {}
+    if owner_rank(start_state, size) == rank:
+        forward, forward_seen = FrontierArena(start_state), {start_state: (0, 0)}
+    backward, backward_seen = FrontierArena(), {}
+    if backward_db is not None:
+        # The DB covers the roots themselves, so they stay out of backward_seen
+        backward = FrontierArena(roots=back_roots[owner_rank(back_roots, size) == rank])
+    elif owner_rank(SOLVED_INDEX, size) == rank:
+        backward, backward_seen = FrontierArena(SOLVED_INDEX), {SOLVED_INDEX: (0, 0)}
+
+    step = 0
+    sizes = np.empty((size, 2), dtype=np.int64)
+    while True:
+        # --- A. TERMINATION CHECK and choice of side ---
+        prof.begin_step(step)
+        with prof.phase("allgather"):
+            comm.Allgather(np.array([len(forward.frontier), len(backward.frontier)],
+                                    dtype=np.int64), sizes)
+        totals = sizes.sum(axis=0)
+        if totals.min() == 0:
+            return None, local_state_count, local_bytes
+        is_forward = totals[0] <= totals[1]
+        if is_forward:
+            arena, side_seen, other, other_seen = forward, forward_seen, backward, backward_seen
+        else:
+            arena, side_seen, other, other_seen = backward, backward_seen, forward, forward_seen
+        level = arena.depth
+        if rank == 0:
+            log(f"[Step {step}] Frontier Size: {int(totals[0 if is_forward else 1])} "
+                f"({'forward' if is_forward else 'backward'} level {level})")
+
+        # --- B. EXPANSION of this rank's share of the level ---
+        # Meet report: (state, parent handle, move code, other side's level
+        # and position or -1 for the DB, rank holding that node), -1 if none
+        meet = np.full(6, -1, dtype=np.int64)
+        with prof.phase("expand"):
+            frontier = np.frombuffer(arena.frontier, dtype=np.uint32)
+            codes = np.frombuffer(arena.moves[level], dtype=np.uint8)
+            children = apply_moves_batch(frontier)
+            next_codes = PRUNE_NEXT[codes]
+            allowed = next_codes >= 0
+            parents = np.arange(len(frontier), dtype=np.int64) * size + rank
+            parents = np.broadcast_to(parents[:, None], children.shape)[allowed]
+            children, next_codes = children[allowed], next_codes[allowed]
+            local_state_count += len(children)
+        if backward_db is not None:
+            with prof.phase("lookup"):
+                in_db = backward_db.lookup(children) != NO_MOVE
+            if is_forward and in_db.any():
+                i = int(np.argmax(in_db))
+                meet[:3] = children[i], parents[i], next_codes[i]
+            elif not is_forward:
+                # Backward children inside the DB were visited by its inner levels
+                children, parents, next_codes = \
+                    children[~in_db], parents[~in_db], next_codes[~in_db]
+
+        # --- C. ALL-TO-ALL EXCHANGE: route every child to its owner ---
+        with prof.phase("dedup"):
+            records = np.empty(len(children), dtype=CANDIDATE)
+            records["state"], records["parent"], records["move"] = children, parents, next_codes
+            _, first = np.unique(records["state"], return_index=True)
+            first.sort()
+            records = records[first]
+            owners = owner_rank(records["state"].astype(np.int64), size)
+        with prof.phase("exchange") as info:
+            incoming, sent = exchange_candidates(comm, records, owners)
+            info["sent"] = sent
+            info["received"] = (len(incoming) - int(np.count_nonzero(owners == rank))) \
+                * CANDIDATE.itemsize
+        local_bytes += sent
+
+        # --- D. LOCAL DEDUP; the owner also meets the other side here ---
+        with prof.phase("dedup"):
+            keep = []
+            for j, key in enumerate(incoming["state"].tolist()):
+                hit = other_seen.get(key)
+                if hit is not None and meet[0] < 0:
+                    meet[:] = (key, incoming["parent"][j], incoming["move"][j], hit[0], hit[1], rank)
+                if key not in side_seen:
+                    side_seen[key] = (level + 1, len(keep))
+                    keep.append(j)
+            kept = incoming[keep]
+            new_states, new_parents, new_moves = arena.new_level()
+            new_states.frombytes(np.ascontiguousarray(kept["state"]).tobytes())
+            new_parents.frombytes(np.ascontiguousarray(kept["parent"]).tobytes())
+            new_moves.frombytes(np.ascontiguousarray(kept["move"]).tobytes())
+
+        # --- E. TERMINATION DECISION (Rank 0) ---
+        with prof.phase("decide"):
+            all_meets = np.empty((size, 6), dtype=np.int64) if rank == 0 else None
+            comm.Gather(meet, all_meets, root=0)
+            decision = np.full(6, -1, dtype=np.int64)
+            if rank == 0:
+                found = all_meets[all_meets[:, 0] >= 0]
+                if len(found):
+                    decision[:] = found[0]
+            comm.Bcast(decision, root=0)
+        if decision[0] >= 0:
+            meet_state, handle, code, other_level, other_pos, holder = (int(x) for x in decision)
+            pos, owner = divmod(handle, size)
+            with prof.phase("trace"):
+                side_path = trace_forward_path(comm, arena, level, owner, pos)
+                other_path = (trace_forward_path(comm, other, other_level, holder, other_pos)
+                              if other_level >= 0 else [])
+            if rank == 0:
+                side_path.append(RESTRICTED_MOVES[SEQ_MOVE[code]])
+                if is_forward:
+                    sol = side_path + backward_path(meet_state, other_path, backward_db)
+                else:
+                    sol = other_path + backward_path(meet_state, side_path, backward_db)
+                return sol, local_state_count, local_bytes
+            return None, local_state_count, local_bytes
+        step += 1
+
+def read_scrambles(stream):
+    """Yields stripped scramble lines from an open stream, skipping comments."""
+    with stream:
+        for line in stream:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                yield line
+
+def _guard_read(comm, lines, source):
+    # Aborts every rank if reading fails mid-file, like a failed open
+    try:
+        yield from lines
+    except (OSError, UnicodeDecodeError) as e:
+        print(f"Error: cannot read {source}: {e}", file=sys.stderr, flush=True)
+        comm.Abort(1)
+
+def run_batch(comm, source, search):
+    """
+    Solves every scramble in `source` with the already loaded DB. Rank 0
+    reads the scrambles and broadcasts each start state (None = stop); all
+    ranks then run search(start, log), a collective returning
+    (solution, states explored, bytes sent) like distributed_search.
+    Prints one JSON line per scramble.
+    Returns (states explored, bytes sent) by this rank over the whole batch.
+    """
+    rank = comm.Get_rank()
+    quiet = lambda *a: None
+    total_count = 0
+    total_bytes = 0
+    solved = 0
+    batch_start = time.perf_counter()
+
+    # Rank 0 opens the file up front: failing inside the bcast loop would
+    # leave the other ranks waiting forever
+    scrambles = None
+    if rank == 0:
+        try:
+            stream = sys.stdin if source == "-" else open(source, "r")
+            scrambles = _guard_read(comm, read_scrambles(stream), source)
+        except OSError as e:
+            print(f"Error: cannot read {source}: {e}", file=sys.stderr, flush=True)
+            comm.Abort(1)
+    while True:
+        start, result = None, None
+        if rank == 0:
+            # Invalid lines are reported directly, without a collective round
+            for line in scrambles:
+                result = {"scramble": line}
+                t0 = time.perf_counter()
+                try:
+                    start, setup_moves = prepare_state(parse_state(line))
+                    result["rotation"] = " ".join(setup_moves)
+                    break
+                except ValueError as e:
+                    result["error"] = str(e)
+                    result["wall_time"] = round(time.perf_counter() - t0, 6)
+                    print(json.dumps(result), flush=True)
+
+        start = comm.bcast(start, root=0)
+        if start is None:
+            break
+
+        sol, count, sent = search(start, quiet)
+        explored = comm.reduce(count, op=MPI.SUM, root=0)
+        total_count += count
+        total_bytes += sent
+
+        if rank == 0:
+            result["solution"] = " ".join(sol) if sol is not None else None
+            result["length"] = len(sol) if sol is not None else None
+            result["states_explored"] = explored
+            result["wall_time"] = round(time.perf_counter() - t0, 6)
+            solved += sol is not None
+            print(json.dumps(result), flush=True)
+
+    if rank == 0:
+        elapsed = time.perf_counter() - batch_start
+        print(f"[Batch] Solved {solved} scrambles in {elapsed:.2f}s", file=sys.stderr, flush=True)
+    return total_count, total_bytes
+
+def main():
+    # Every rank parses the flags; only rank 0 uses the input state
+    parser = argparse.ArgumentParser()
+    parser.add_argument("input", nargs="?", help="State string (space separated)")
+    parser.add_argument("--sym", action="store_true",
+                        help="Dedup by symmetry class: one state per class is visited")
+    parser.add_argument("--batch", metavar="FILE",
+                        help="Solve one scramble per line of FILE ('-' for stdin), "
+                             "writing one JSON result per line")
+    parser.add_argument("--chunk", type=int, default=4096,
+                        help="Frontier states expanded between checks for a meet (default: 4096)")
+    parser.add_argument("--steal", action="store_true",
+                        help="Dynamic load balancing: idle ranks steal chunks of other ranks' frontiers")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Local processes per rank sharing the memory-mapped DB "
+                             "(hybrid mode: one rank per node, one worker per core). "
+                             "Workers are forked before MPI is initialized")
+    parser.add_argument("--pipeline", action="store_true",
+                        help="Stream each chunk's children to their owners with non-blocking "
+                             "sends while the next chunk expands")
+    parser.add_argument("--bidir", action="store_true",
+                        help="Bidirectional search: grow the smaller of the forward and "
+                             "backward frontiers each step (halfway.pdb optional)")
+    parser.add_argument("--profile", metavar="TRACE",
+                        help="Time every phase of every step on every rank; write a "
+                             "Chrome trace to TRACE and print a phase summary")
+    args = parser.parse_args()
+    if not args.batch and not args.input:
+        parser.error("a state (or --batch FILE) is required")
+    if args.bidir and (args.sym or args.steal or args.workers > 1 or args.pipeline):
+        parser.error("--bidir expands whole levels and can't be combined with "
+                     "--sym, --steal, --workers or --pipeline")
+
+    # In batch mode stdout carries only JSON results
+    log = (lambda msg: print(msg, file=sys.stderr, flush=True)) if args.batch \
+        else (lambda msg: print(msg, flush=True))
 
     # --- 1. Load Database ---
+    # Memory-mapped: ranks on the same node share the page cache
     backward_db = None
+    db_error = None
+    t0 = time.perf_counter()
     try:
-        with open(DB_FILE, "rb") as f:
-            backward_db = pickle.load(f)
+        backward_db = open_pattern_db(DB_FILE)
     except Exception as e:
-        print(f"[Node {rank}] Error loading DB: {e}", flush=True)
+        # The bidirectional search can run without a DB
+        if not (args.bidir and isinstance(e, FileNotFoundError)):
+            db_error = e
+    load_time = time.perf_counter() - t0
+    back_roots = None
+    if args.bidir and backward_db is not None:
+        back_roots = backward_db.outer_layer()
+
+    # Hybrid mode: forked workers inherit the DB mapping, so it isn't copied.
+    # They are forked before MPI_Init, so they never hold MPI state.
+    pool = None
+    if args.workers > 1 and db_error is None:
+        pool = ExpansionPool(backward_db, args.workers)
+
+    # --- MPI INIT ---
+    MPI.Init()
+    comm = MPI.COMM_WORLD
+    rank = comm.Get_rank()
+    if db_error is not None:
+        log(f"[Node {rank}] Error loading DB: {db_error}")
         comm.Abort(1)
         sys.exit(1)
-
-    print(f"[Node {rank}] Database loaded. Active.", flush=True)
+    if backward_db is None:
+        log(f"[Node {rank}] No DB found; searching from both ends. Active.")
+    else:
+        log(f"[Node {rank}] Database loaded in {load_time:.3f}s. Active."
+            + (f" {args.workers} local workers." if pool else ""))
 
     # BARRIER 1: Ensure all nodes are ready before Manager starts
     comm.Barrier()
+    prof = PhaseProfiler(rank, enabled=bool(args.profile))
+    prof.reset_clock()
+    if args.bidir:
+        search = lambda start, log: bidirectional_search(comm, start, backward_db, back_roots,
+                                                         log, prof)
+    else:
+        search = lambda start, log: distributed_search(comm, start, backward_db, args.sym, log,
+                                                       args.chunk, args.steal, pool, prof,
+                                                       args.pipeline)
+
+    if args.batch:
+        local_state_count, local_bytes = run_batch(comm, args.batch, search)
+    else:
+        start_state = None
+        if rank == 0:
+            try:
+                # Parse input string
+                start_state = parse_state(args.input)
+            except ValueError:
+                print("Error: Invalid input format.", flush=True)
+                comm.Abort(1)
+            
+            # Normalization
+            try:
+                start_state, setup_moves = prepare_state(start_state)
+            except ValueError as e:
+                print(f"Error: {e}", flush=True)
+                comm.Abort(1)
 
-    # --- 2. Setup Manager (Rank 0) ---
-    global_visited = set()
-    frontier = [] 
-    local_state_count = 0 # Stat tracking
-    
-    # Logic flags
-    found_solution_flag = False
-    
-    if rank == 0:
-        parser = argparse.ArgumentParser()
-        parser.add_argument("input", help="State string (space separated)")
-        args = parser.parse_args()
-        
-        try:
-            # Parse input string
-            start_state = tuple(map(int, args.input.split()))
-        except Exception:
-            print("Error: Invalid input format.", flush=True)
-            comm.Abort(1)
-        
-        # Normalization
-        try:
-            norm_state, setup_moves = normalize_to_fixed_corner(start_state)
             if setup_moves:
                 print("\n" + "="*40, flush=True)
                 print("PRE-SOLVE ORIENTATION REQUIRED", flush=True)
@@ -110,129 +704,50 @@ def main():
                 print("="*40 + "\n", flush=True)
             else:
                 print("[Manager] Cube oriented correctly.", flush=True)
-            start_state = norm_state
-        except ValueError as e:
-            print(f"Error: {e}", flush=True)
-            comm.Abort(1)
-
-        print(f"[Manager] Solving Normalized State...", flush=True)
-        
-        # Check if start is already in DB
-        if start_state in backward_db:
-            sol = reconstruct_full_path(start_state, [], backward_db)
-            print("\n*** SOLUTION FOUND (In DB) ***", flush=True)
-            print(f"Moves: {' '.join(sol)}", flush=True)
-            found_solution_flag = True
-            # We do NOT exit here. We enter the loop so we can cleanly tell workers to STOP.
-        else:
-            frontier = [(start_state, [])]
-            global_visited.add(start_state)
+            print(f"[Manager] Solving Normalized State...", flush=True)
 
-    # --- 3. Synchronous BFS Loop ---
-    step = 0
-    while True:
-        # --- A. DECISION PHASE (Happens at Top of Loop) ---
-        instruction = "SEARCH"
-        
-        if rank == 0:
-            if found_solution_flag:
-                instruction = "DONE"
-            elif not frontier:
-                instruction = "FAIL"
-        
-        # Broadcast decision to all workers
-        instruction = comm.bcast(instruction, root=0)
-        
-        # Check decision
-        if instruction == "DONE":
-            break
-        if instruction == "FAIL":
-            if rank == 0: print("Search exhausted. No solution.", flush=True)
-            break
+        final_sol, local_state_count, local_bytes = search(start_state, log)
 
-        # --- B. WORK DISTRIBUTION ---
-        chunks = []
-        if rank == 0:
-            print(f"[Step {step}] Frontier Size: {len(frontier)}", flush=True)
-            pad_needed = (size - (len(frontier) % size)) % size
-            frontier.extend([None] * pad_needed)
-            k = len(frontier) // size
-            chunks = [frontier[i * k : (i + 1) * k] for i in range(size)]
-        
-        local_tasks = comm.scatter(chunks, root=0)
-
-        # --- C. LOCAL COMPUTATION ---
-        local_next_level = []
-        solution_found = None
-
-        if local_tasks:
-            for task in local_tasks:
-                if task is None: continue
-                
-                curr_state, curr_path = task
-                
-                # Use Restricted Move Set (R, U, F) to stay in fixed-corner space
-                MOVES_TO_USE = [m for m in ALL_MOVES if m[0] in ['R', 'U', 'F']]
-                
-                for m_name in MOVES_TO_USE:
-                    local_state_count += 1 # Increment counter
-                    
-                    nxt = apply_move(curr_state, m_name)
-                    
-                    if nxt in backward_db:
-                        solution_found = reconstruct_full_path(nxt, curr_path + [m_name], backward_db)
-                        break
-                    
-                    local_next_level.append((nxt, curr_path + [m_name]))
-                
-                if solution_found: break
-
-        # --- D. GATHER RESULTS ---
-        all_solutions = comm.gather(solution_found, root=0)
-        all_candidates = comm.gather(local_next_level, root=0)
-
-        # --- E. MANAGER UPDATE (Rank 0 only) ---
         if rank == 0:
-            final_sol = next((s for s in all_solutions if s), None)
-            
-            if final_sol:
+            if final_sol is None:
+                print("Search exhausted. No solution.", flush=True)
+            else:
                 print("\n" + "="*40, flush=True)
                 print("*** SOLUTION FOUND ***", flush=True)
                 print(f"Moves: {len(final_sol)}", flush=True)
                 print(f"Sequence: {' '.join(final_sol)}", flush=True)
                 print("="*40, flush=True)
-                found_solution_flag = True
-                # Loop will repeat, hit Decision Phase, and broadcast DONE.
-            else:
-                # Update frontier for next step
-                new_frontier = []
-                for batch in all_candidates:
-                    for state, path in batch:
-                        if state not in global_visited:
-                            global_visited.add(state)
-                            new_frontier.append((state, path))
-                frontier = new_frontier
-                step += 1
-        
-        # Workers hit end of loop and return to 'instruction = comm.bcast'
     
     # --- 4. GATHER STATISTICS ---
-    # Everyone reaches here after 'break'
+    # Everyone reaches here after the search loop
     comm.Barrier() # Optional safety
     
-    all_counts = comm.gather(local_state_count, root=0)
+    if pool is not None:
+        pool.close()
+    all_counts = comm.gather((local_state_count, local_bytes), root=0)
 
     if rank == 0:
-        print("\n--- Cluster Statistics ---", flush=True)
-        total_explored = sum(all_counts)
-        print(f"{'Rank':<10} | {'States Explored':<15} | {'Contribution':<12}", flush=True)
-        print("-" * 45, flush=True)
-        for r, count in enumerate(all_counts):
+        out = sys.stderr if args.batch else sys.stdout
+        print("\n--- Cluster Statistics ---", file=out, flush=True)
+        total_explored = sum(c for c, _ in all_counts)
+        total_sent = sum(b for _, b in all_counts)
+        print(f"{'Rank':<10} | {'States Explored':<15} | {'Contribution':<12} | {'Bytes Sent':<12}", file=out, flush=True)
+        print("-" * 60, file=out, flush=True)
+        for r, (count, sent) in enumerate(all_counts):
             pct = (count / total_explored * 100) if total_explored > 0 else 0
-            print(f"{r:<10} | {count:<15} | {pct:.1f}%", flush=True)
-        print("-" * 45, flush=True)
-        print(f"Total States Explored: {total_explored}", flush=True)
-        print("-" * 45, flush=True)
+            print(f"{r:<10} | {count:<15} | {f'{pct:.1f}%':<12} | {sent:<12}", file=out, flush=True)
+        print("-" * 60, file=out, flush=True)
+        print(f"Total States Explored: {total_explored}", file=out, flush=True)
+        print(f"Total Bytes Exchanged: {total_sent}", file=out, flush=True)
+        print("-" * 60, file=out, flush=True)
+
+    # --- 5. PHASE PROFILE (--profile) ---
+    if args.profile:
+        rank_events = comm.gather(prof.events, root=0)
+        if rank == 0:
+            write_chrome_trace(args.profile, rank_events)
+            print_summary(rank_events, out)
+            print(f"Trace written to {args.profile}", file=out, flush=True)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+mpi_utils.py: Candidate exchange between MPI ranks, shared by mpi_solver.py
+and the MPI mode of generate_db.py.
+Every state (or symmetry class) has one owner rank (owner_rank). Each
+BFS level, ranks pack the children they generate into fixed-size
+records and route them to their owners, either all at once with one
+Alltoallv (exchange_candidates) or streamed with Isend while expansion
+goes on (StreamExchange).
+"""
+from mpi4py import MPI
+import numpy as np
+
+# Wire format of one candidate in the all-to-all exchange (9 bytes, packed):
+# child state index, parent handle, move code (see cube_utils.PRUNE_NEXT). With --sym the symmetry
+# class is sent along (13 bytes) so owners don't recompute it.
+CANDIDATE = np.dtype([("state", "<u4"), ("parent", "<i4"), ("move", "u1")])
+CANDIDATE_SYM = np.dtype(CANDIDATE.descr + [("key", "<u4")])
+
+def owner_rank(key, size):
+    """
+    Rank that owns a state (or symmetry class) key: it alone keeps the key
+    in its visited set and expands the state. Knuth multiplicative hash,
+    so neighbouring indices spread over all ranks. Works on scalars and
+    NumPy arrays.
+    """
+    return ((key * 2654435761) & 0xFFFFFFFF) % size
+
+def exchange_candidates(comm, records, owners):
+    """
+    Sends every record to the rank in `owners` with one MPI_Alltoallv over
+    raw bytes (counts are exchanged first with MPI_Alltoall).
+    Returns (records received by this rank, bytes sent to other ranks).
+    """
+    rank, size = comm.Get_rank(), comm.Get_size()
+    item = records.dtype.itemsize
+    send = records[np.argsort(owners, kind="stable")]
+    send_counts = np.bincount(owners, minlength=size).astype(np.int32)
+    recv_counts = np.empty(size, dtype=np.int32)
+    comm.Alltoall(send_counts, recv_counts)
+
+    recv = np.empty(int(recv_counts.sum()), dtype=records.dtype)
+    send_bytes, recv_bytes = send_counts * item, recv_counts * item
+    send_displs = np.concatenate(([0], np.cumsum(send_bytes)[:-1])).astype(np.int32)
+    recv_displs = np.concatenate(([0], np.cumsum(recv_bytes)[:-1])).astype(np.int32)
+    comm.Alltoallv([send.view(np.uint8), (send_bytes, send_displs), MPI.BYTE],
+                   [recv.view(np.uint8), (recv_bytes, recv_displs), MPI.BYTE])
+    return recv, int(send_bytes.sum() - send_bytes[rank])
+
+def pack_candidates(parts, record_type, use_sym=False):
+    """
+    Packs expand_chunk results (children, parents, codes, keys) into
+    candidate records, keeping the first copy of every state (or symmetry
+    class): each child is sent at most once per batch.
+    Returns (records, keys).
+    """
+    records = np.empty(sum(len(c) for c, _, _, _ in parts), dtype=record_type)
+    if parts:
+        records["state"] = np.concatenate([c for c, _, _, _ in parts])
+        records["parent"] = np.concatenate([p for _, p, _, _ in parts])
+        records["move"] = np.concatenate([m for _, _, m, _ in parts])
+        if use_sym:
+            # The symmetry class (computed with the children) decides the owner
+            records["key"] = np.concatenate([k for _, _, _, k in parts])
+    keys = records["key"] if use_sym else records["state"]
+    _, first = np.unique(keys, return_index=True)
+    first.sort()
+    return records[first], keys[first]
+
+class StreamExchange:
+    """
+    Streaming counterpart of exchange_candidates for one level. Each batch
+    of records is routed to its owners with Isend as soon as it is packed,
+    and poll() returns the batches that have already arrived, so expansion,
+    network transfer and owner dedup overlap instead of running in turn.
+    An empty message closes a rank's stream; finish() closes this rank's
+    and receives until every other rank has closed its own. Messages
+    between two ranks arrive in order, so no batch crosses into the next
+    level.
+    """
+    TAG = 78
+
+    def __init__(self, comm, record_type):
+        self.comm = comm
+        self.rank = comm.Get_rank()
+        self.size = comm.Get_size()
+        self.record_type = record_type
+        self.status = MPI.Status()
+        self.sends = [] # (request, buffer): buffers live until their send completes
+        self.closed = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    def send(self, records, owners):
+        """Isends a batch to its owners and returns the records this rank owns."""
+        order = np.argsort(owners, kind="stable")
+        records, owners = records[order], owners[order]
+        bounds = np.searchsorted(owners, np.arange(self.size + 1))
+        for r in range(self.size):
+            if r != self.rank and bounds[r + 1] > bounds[r]:
+                buf = np.ascontiguousarray(records[bounds[r]:bounds[r + 1]])
+                req = self.comm.Isend([buf.view(np.uint8), MPI.BYTE], dest=r, tag=self.TAG)
+                self.sends.append((req, buf))
+                self.bytes_sent += buf.nbytes
+        self.sends = [(req, buf) for req, buf in self.sends if not req.Test()]
+        return records[bounds[self.rank]:bounds[self.rank + 1]]
+
+    def _recv(self):
+        n = self.status.Get_count(MPI.BYTE)
+        batch = np.empty(n // self.record_type.itemsize, dtype=self.record_type)
+        self.comm.Recv([batch.view(np.uint8), MPI.BYTE],
+                       source=self.status.Get_source(), tag=self.TAG)
+        self.closed += n == 0
+        self.bytes_received += n
+        return batch
+
+    def poll(self):
+        """Yields every batch that has arrived so far, without blocking."""
+        while self.comm.Iprobe(source=MPI.ANY_SOURCE, tag=self.TAG, status=self.status):
+            yield self._recv()
+
+    def finish(self):
+        """Closes this rank's stream and yields the remaining batches."""
+        end = np.empty(0, dtype=np.uint8)
+        for r in range(self.size):
+            if r != self.rank:
+                self.sends.append((self.comm.Isend([end, MPI.BYTE], dest=r, tag=self.TAG), end))
+        while self.closed < self.size - 1:
+            self.comm.Probe(source=MPI.ANY_SOURCE, tag=self.TAG, status=self.status)
+            yield self._recv()
+        MPI.Request.Waitall([req for req, _ in self.sends])
+        self.sends = []
@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+"""
+pattern_db.py: On-disk pattern database formats keyed by state index.
+Distance tables are packed 4 bits per state (two states per byte).
+The halfway DB is a versioned binary file of one move byte per state,
+opened with mmap so every process on a node shares the same pages. It can
+also be split into shard files (one per MPI rank that generated it),
+which open_pattern_db maps together as one logical DB.
+"""
+import os
+import re
+import glob
+import mmap
+import struct
+
+import numpy as np
+from cube_utils import (
+    N_STATES, N_MOVES, SOLVED_INDEX, RESTRICTED_MOVES, apply_move_index,
+    get_inverse_move, apply_moves_batch, canonical_indices
+)
+
+DIST_FILE = "distance.npy"
+SYM_DIST_FILE = "distance_sym.npz"
+MOVES_FILE = "moves.npy"
+PDB_FILE = "halfway.pdb"
+
+# Binary DB layout: 32-byte header, then N_STATES move bytes (by state index).
+# magic, version, n_states, depth, number of states stored
+PDB_MAGIC = b"CUBEPDB\0"
+PDB_VERSION = 1
+_PDB_HEADER = struct.Struct("<8sIIII")
+PDB_HEADER_SIZE = 32
+
+# Shard layout: same 32-byte header size plus shard number and shard count,
+# then one move byte for every state i with i % n_shards == shard, in order.
+SHARD_MAGIC = b"CUBESHD\0"
+_SHARD_HEADER = struct.Struct("<8sIIIIII")
+
+# Nibble value for states beyond the generated depth. Max QTM distance is 14.
+UNKNOWN_DIST = 15
+# Move byte for the solved state and for states beyond the generated depth.
+NO_MOVE = 255
+# Move byte marking the solved state in the binary DB (NO_MOVE = absent).
+SOLVED_MARK = 254
+
+def pack_distances(dist):
+    """Packs a uint8 distance-per-state array into nibbles (even index = low)."""
+    dist = np.asarray(dist, dtype=np.uint8)
+    return dist[0::2] | (dist[1::2] << 4)
+
+def unpack_distances(packed):
+    """Inverse of pack_distances."""
+    dist = np.empty(len(packed) * 2, dtype=np.uint8)
+    dist[0::2] = packed & 0x0F
+    dist[1::2] = packed >> 4
+    return dist
+
+def get_distance(packed, index):
+    """Distance to solved for one state index (UNKNOWN_DIST if not generated)."""
+    b = int(packed[index >> 1])
+    return b >> 4 if index & 1 else b & 0x0F
+
+def load_distance_table(path=DIST_FILE):
+    """Memory-maps a packed distance table written by generate_db.py."""
+    packed = np.load(path, mmap_mode="r")
+    if packed.shape != (N_STATES // 2,):
+        raise ValueError(f"{path}: unexpected table shape {packed.shape}")
+    return packed
+
+def load_move_table(path=MOVES_FILE):
+    """Memory-maps the optional move-byte table written by generate_db.py."""
+    moves = np.load(path, mmap_mode="r")
+    if moves.shape != (N_STATES,):
+        raise ValueError(f"{path}: unexpected table shape {moves.shape}")
+    return moves
+
+def load_heuristic(path=DIST_FILE):
+    """
+    Admissible lower-bound table for heuristic search, as bytes indexed by
+    state. A depth-limited table (generate_db.py --mode table --depth N)
+    knows the exact distance up to its horizon, so unknown states are at
+    least horizon + 1 away. Returns (table, horizon).
+    """
+    dist = unpack_distances(load_distance_table(path))
+    known = dist != UNKNOWN_DIST
+    horizon = int(dist[known].max())
+    dist[~known] = horizon + 1
+    return dist.tobytes(), horizon
+
+def solve_with_table(index, packed, moves=None):
+    """
+    Optimal solution by greedy descent: at every step take a move that lowers
+    the distance by one. With a move-byte table the move is read directly.
+    Returns a list of move names, or None if the state is beyond the table.
+    """
+    dist = get_distance(packed, index)
+    if dist == UNKNOWN_DIST:
+        return None
+
+    path = []
+    while dist > 0:
+        if moves is not None:
+            m = int(moves[index])
+            nxt = apply_move_index(index, m)
+        else:
+            for m in range(N_MOVES):
+                nxt = apply_move_index(index, m)
+                if get_distance(packed, nxt) == dist - 1:
+                    break
+            else:
+                raise ValueError("Distance table is inconsistent.")
+        path.append(RESTRICTED_MOVES[m])
+        index = nxt
+        dist -= 1
+    return path
+
+def load_sym_table(path=SYM_DIST_FILE):
+    """
+    Loads a symmetry-reduced distance table: (classes, dist), where classes
+    is the sorted array of canonical indices and dist their distances.
+    """
+    with np.load(path) as data:
+        return data["classes"], data["dist"]
+
+def get_sym_distances(table, indices):
+    """Distances for an array of state indices via their symmetry class."""
+    classes, dist = table
+    canon = canonical_indices(indices)
+    pos = np.minimum(np.searchsorted(classes, canon), len(classes) - 1)
+    return np.where(classes[pos] == canon, dist[pos], UNKNOWN_DIST)
+
+def solve_with_sym_table(index, table):
+    """solve_with_table over a symmetry-reduced table (one entry per class)."""
+    dist = int(get_sym_distances(table, [index])[0])
+    if dist == UNKNOWN_DIST:
+        return None
+
+    path = []
+    while dist > 0:
+        children = apply_moves_batch([index])[0]
+        m = int(np.argmax(get_sym_distances(table, children) == dist - 1))
+        path.append(RESTRICTED_MOVES[m])
+        index = int(children[m])
+        dist -= 1
+    return path
+
+def write_pattern_db(moves, depth, path=PDB_FILE):
+    """
+    Writes a binary DB from a per-state move array (move toward solved,
+    SOLVED_MARK for the root, NO_MOVE for states not in the DB).
+    """
+    moves = np.asarray(moves, dtype=np.uint8)
+    if moves.shape != (N_STATES,):
+        raise ValueError(f"Expected {N_STATES} move bytes, got {moves.shape}")
+    count = int(np.count_nonzero(moves != NO_MOVE))
+    header = _PDB_HEADER.pack(PDB_MAGIC, PDB_VERSION, N_STATES, depth, count)
+    with open(path, "wb") as f:
+        f.write(header.ljust(PDB_HEADER_SIZE, b"\0"))
+        f.write(moves.tobytes())
+    return count
+
+# Shard file suffix: at least three digits, more with 1000+ shards
+_SHARD_SUFFIX = ".shard{:03d}"
+_SHARD_NAME = re.compile(r"\.shard(\d{3,})$")
+
+def shard_path(path, shard):
+    """File name of one shard of the DB at `path`."""
+    return path + _SHARD_SUFFIX.format(shard)
+
+def find_shards(path):
+    """
+    Shard files of the DB at `path`, in shard order. Any number of shards
+    is found; whether they are complete is checked against their headers
+    when they are opened.
+    """
+    found = []
+    for name in glob.glob(glob.escape(path) + ".shard*"):
+        m = _SHARD_NAME.search(name)
+        if m and name[:m.start()] == path:
+            found.append((int(m.group(1)), name))
+    return [name for _, name in sorted(found)]
+
+def shard_size(shard, n_shards):
+    """Number of states owned by `shard` (indices shard, shard + n, ...)."""
+    return len(range(shard, N_STATES, n_shards))
+
+def write_pattern_shard(moves, shard, n_shards, depth, path=PDB_FILE):
+    """
+    Writes one shard of a binary DB: the move bytes of the states owned by
+    `shard`, ordered by index. Returns the number of states stored.
+    """
+    moves = np.asarray(moves, dtype=np.uint8)
+    if moves.shape != (shard_size(shard, n_shards),):
+        raise ValueError(f"Expected {shard_size(shard, n_shards)} move bytes, got {moves.shape}")
+    count = int(np.count_nonzero(moves != NO_MOVE))
+    header = _SHARD_HEADER.pack(SHARD_MAGIC, PDB_VERSION, N_STATES, depth, count,
+                                shard, n_shards)
+    tmp = shard_path(path, shard) + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(header.ljust(PDB_HEADER_SIZE, b"\0"))
+        f.write(moves.tobytes())
+    os.replace(tmp, shard_path(path, shard))
+    return count
+
+class _MoveByteDB:
+    """
+    Dict-like API shared by the DB readers. It mirrors the old halfway.pkl
+    ({state: (parent, move)}), so reconstruct_full_path works unchanged.
+    Subclasses provide _byte(index) and lookup(indices).
+    """
+
+    def __contains__(self, index):
+        return self._byte(index) != NO_MOVE
+
+    def __len__(self):
+        return self.count
+
+    def get(self, index, default=None):
+        """(parent index, move from parent) like the old dict, or default."""
+        m = self._byte(index)
+        if m == NO_MOVE:
+            return default
+        if m == SOLVED_MARK:
+            return (None, None)
+        return (apply_move_index(index, m), get_inverse_move(RESTRICTED_MOVES[m]))
+
+    def outer_layer(self):
+        """
+        Sorted indices of the states exactly `depth` moves from solved: the
+        DB's last level, from which a bidirectional search keeps growing
+        the backward side. Found by a vectorized BFS, as the DB holds
+        moves rather than distances.
+        """
+        seen = np.zeros(N_STATES, dtype=bool)
+        seen[SOLVED_INDEX] = True
+        frontier = np.array([SOLVED_INDEX], dtype=np.int64)
+        for _ in range(self.depth):
+            children = np.unique(apply_moves_batch(frontier).ravel())
+            frontier = children[~seen[children]]
+            seen[frontier] = True
+        return frontier
+
+class PatternDB(_MoveByteDB):
+    """Read-only, memory-mapped view of a binary DB keyed by state index."""
+
+    def __init__(self, path=PDB_FILE):
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, n_states, depth, count = _PDB_HEADER.unpack_from(self._mm)
+        if magic != PDB_MAGIC:
+            raise ValueError(f"{path}: not a pattern database file")
+        if version != PDB_VERSION or n_states != N_STATES:
+            raise ValueError(f"{path}: unsupported DB version {version}")
+        if len(self._mm) != PDB_HEADER_SIZE + N_STATES:
+            raise ValueError(f"{path}: truncated DB file")
+        self.depth = depth
+        self.count = count
+        self._moves = memoryview(self._mm)[PDB_HEADER_SIZE:]
+
+    @property
+    def moves(self):
+        """Zero-copy NumPy view of the move bytes, for vectorized lookups."""
+        return np.frombuffer(self._moves, dtype=np.uint8)
+
+    def _byte(self, index):
+        return self._moves[index]
+
+    def lookup(self, indices):
+        """Move bytes for an array of state indices (NO_MOVE if absent)."""
+        return self.moves[indices]
+
+    def close(self):
+        self._moves.release()
+        self._mm.close()
+
+class ShardedPatternDB(_MoveByteDB):
+    """
+    Read-only view of a DB split into shard files, as one logical DB.
+    State i lives in shard i % n_shards at position i // n_shards, so a
+    lookup is one modulo away from the single-file layout.
+    """
+
+    def __init__(self, paths):
+        shards = {}
+        for path in paths:
+            with open(path, "rb") as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, version, n_states, depth, count, shard, n_shards = \
+                _SHARD_HEADER.unpack_from(mm)
+            if magic != SHARD_MAGIC:
+                raise ValueError(f"{path}: not a pattern database shard")
+            if version != PDB_VERSION or n_states != N_STATES:
+                raise ValueError(f"{path}: unsupported DB version {version}")
+            if len(mm) != PDB_HEADER_SIZE + shard_size(shard, n_shards):
+                raise ValueError(f"{path}: truncated DB shard")
+            shards[shard] = (mm, depth, count, n_shards)
+
+        n_shards = {n for _, _, _, n in shards.values()}
+        if len(n_shards) != 1 or set(shards) != set(range(next(iter(n_shards)))):
+            raise ValueError(f"Incomplete or mixed DB shards: {sorted(paths)}")
+        if len({d for _, d, _, _ in shards.values()}) != 1:
+            raise ValueError("DB shards were generated to different depths")
+
+        self.n_shards = n_shards.pop()
+        self._mms = [shards[i][0] for i in range(self.n_shards)]
+        self._shards = [memoryview(mm)[PDB_HEADER_SIZE:] for mm in self._mms]
+        self.depth = shards[0][1]
+        self.count = sum(c for _, _, c, _ in shards.values())
+
+    def _byte(self, index):
+        return self._shards[index % self.n_shards][index // self.n_shards]
+
+    def lookup(self, indices):
+        """Move bytes for an array of state indices (NO_MOVE if absent)."""
+        indices = np.asarray(indices, dtype=np.int64)
+        pos, shard = np.divmod(indices, self.n_shards)
+        out = np.empty(indices.shape, dtype=np.uint8)
+        for i, view in enumerate(self._shards):
+            mask = shard == i
+            out[mask] = np.frombuffer(view, dtype=np.uint8)[pos[mask]]
+        return out
+
+    def close(self):
+        for view, mm in zip(self._shards, self._mms):
+            view.release()
+            mm.close()
+
+def open_pattern_db(path=PDB_FILE):
+    """
+    Opens the binary DB at `path`, or, if there is no such file, its shards
+    (path.shard000, ...) as one logical DB. Raises FileNotFoundError if
+    neither exists.
+    """
+    if os.path.exists(path):
+        return PatternDB(path)
+    shards = find_shards(path)
+    if not shards:
+        raise FileNotFoundError(path)
+    return ShardedPatternDB(shards)
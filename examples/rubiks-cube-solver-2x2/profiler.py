@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+profiler.py: Optional per-phase instrumentation for mpi_solver.py.
+Every rank times the phases of each BFS step (collectives, expansion, DB
+lookups, exchange, dedup) and counts the bytes it sends and receives.
+Rank 0 gathers the records at the end and writes them as a Chrome trace
+(open in chrome://tracing or ui.perfetto.dev, one track per rank) and
+prints a per-rank summary with the load imbalance of each step.
+"""
+import json
+import time
+from contextlib import contextmanager, nullcontext
+
+# Phases in the order a step runs them, as reported in the summary
+PHASES = ["bcast", "allgather", "expand", "lookup", "decide", "exchange",
+          "dedup", "reduce", "trace"]
+
+class PhaseProfiler:
+    """
+    Records (phase, search, step, start, duration, args) events for one
+    rank. Disabled, phase() hands out a shared no-op context, so the
+    instrumented code pays almost nothing.
+    """
+
+    def __init__(self, rank, enabled=True):
+        self.rank = rank
+        self.enabled = enabled
+        self.events = []
+        self.search = -1
+        self.step = -1
+        self.origin = time.perf_counter()
+        self._null = nullcontext({})
+
+    def reset_clock(self):
+        """Starts the time axis; call right after a barrier so ranks line up."""
+        self.origin = time.perf_counter()
+
+    def begin_search(self):
+        self.search += 1
+        self.step = -1
+
+    def begin_step(self, step):
+        self.step = step
+
+    def phase(self, name):
+        """Context manager timing one phase; yields a dict for extra event args."""
+        if not self.enabled:
+            return self._null
+        return self._timed(name)
+
+    @contextmanager
+    def _timed(self, name):
+        args = {}
+        t0 = time.perf_counter()
+        try:
+            yield args
+        finally:
+            self.events.append((name, self.search, self.step, t0 - self.origin,
+                                time.perf_counter() - t0, args))
+
+class TimedDB:
+    """
+    Pattern DB proxy that times every lookup() as the "lookup" phase.
+    Only used for inline expansion: with an ExpansionPool the lookups run
+    in the workers and are counted in "expand".
+    """
+
+    def __init__(self, db, profiler):
+        self.db = db
+        self.profiler = profiler
+
+    def lookup(self, indices):
+        with self.profiler.phase("lookup"):
+            return self.db.lookup(indices)
+
+def write_chrome_trace(path, rank_events):
+    """
+    Writes the events of every rank (list indexed by rank) in the Chrome
+    trace event format: one process per rank, complete ("X") events in
+    microseconds, with the search, step and byte counts as args.
+    """
+    trace = []
+    for rank, events in enumerate(rank_events):
+        trace.append({"name": "process_name", "ph": "M", "pid": rank, "tid": 0,
+                      "args": {"name": f"Rank {rank}"}})
+        trace.append({"name": "process_sort_index", "ph": "M", "pid": rank, "tid": 0,
+                      "args": {"sort_index": rank}})
+        for name, search, step, start, dur, args in events:
+            trace.append({"name": name, "cat": "mpi", "ph": "X", "pid": rank, "tid": 0,
+                          "ts": round(start * 1e6, 3), "dur": round(dur * 1e6, 3),
+                          "args": dict(args, search=search, step=step)})
+    with open(path, "w") as f:
+        json.dump({"traceEvents": trace, "displayTimeUnit": "ms"}, f)
+
+def step_imbalance(rank_events):
+    """
+    Load imbalance of the expansion phase: {(search, step): max / mean
+    expand time over the ranks}. 1.0 means perfectly balanced.
+    """
+    per_step = {}
+    for rank, events in enumerate(rank_events):
+        for name, search, step, _, dur, _ in events:
+            if name == "expand":
+                per_step.setdefault((search, step), [0.0] * len(rank_events))[rank] += dur
+    return {key: max(times) / (sum(times) / len(times))
+            for key, times in sorted(per_step.items()) if sum(times) > 0}
+
+def print_summary(rank_events, out):
+    """Prints seconds per phase and bytes sent / received per rank, then the imbalance."""
+    print("\n--- Phase Timing (s) ---", file=out, flush=True)
+    cols = [p for p in PHASES if any(e[0] == p for events in rank_events for e in events)]
+    header = f"{'Rank':<6}" + "".join(f" | {p:>9}" for p in cols) + f" | {'Sent':>10} | {'Recv':>10}"
+    print(header, file=out)
+    print("-" * len(header), file=out)
+    for rank, events in enumerate(rank_events):
+        totals = dict.fromkeys(cols, 0.0)
+        sent = recv = 0
+        for name, _, _, _, dur, args in events:
+            totals[name] += dur
+            sent += args.get("sent", 0)
+            recv += args.get("received", 0)
+        print(f"{rank:<6}" + "".join(f" | {totals[p]:>9.4f}" for p in cols)
+              + f" | {sent:>10} | {recv:>10}", file=out)
+    print("-" * len(header), file=out)
+
+    imbalance = step_imbalance(rank_events)
+    if imbalance:
+        worst = max(imbalance, key=imbalance.get)
+        mean = sum(imbalance.values()) / len(imbalance)
+        print(f"Expand imbalance (max/mean): {mean:.2f} average, "
+              f"{imbalance[worst]:.2f} worst (search {worst[0]}, step {worst[1]})", file=out)
+    print("-" * len(header), file=out, flush=True)
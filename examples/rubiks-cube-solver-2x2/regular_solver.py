@@ -2,60 +2,27 @@
 """
 regular_solver.py: Single-machine 2x2 Cube Solver (Debugging Version).
 Uses the same logic as mpi_solver.py but without MPI dependencies.
+With --batch, solves a stream of scrambles with one DB load and writes
+one JSON result line per scramble.
 """
-import pickle
+import os
 import sys
+import json
+import time
 import argparse
-from collections import deque
-from cube_utils import ALL_MOVES, apply_move, get_inverse_move
+from cube_utils import (
+    RESTRICTED_MOVES, SOLVED_INDEX, SEQ_START, ALLOWED_MOVES, PRUNE_NEXT_LIST,
+    apply_move_index, get_inverse_move, canonical_index, canonical_indices,
+    parse_state, prepare_state
+)
+from frontier import FrontierArena, backward_path
+from pattern_db import (
+    DIST_FILE, MOVES_FILE, PDB_FILE, SYM_DIST_FILE, open_pattern_db,
+    load_distance_table, load_move_table, load_heuristic, load_sym_table,
+    solve_with_table, solve_with_sym_table
+)
 
-DB_FILE = "halfway.pkl"
-
-def apply_cube_rotation(state, rot_axis):
-    """
-    Simulates a whole cube rotation using basic face turns.
-    y (Vertical axis)   = U + D'
-    x (Horizontal axis) = R + L'
-    """
-    if rot_axis == 'y':
-        # Rotate around U/D axis
-        s = apply_move(state, 'U')
-        return apply_move(s, "D'")
-    elif rot_axis == 'x':
-        # Rotate around R/L axis
-        s = apply_move(state, 'R')
-        return apply_move(s, "L'")
-    return state
-
-def normalize_to_fixed_corner(state):
-    """
-    Finds a sequence of whole-cube rotations (x, y) to place the
-    Back-Down-Left corner stickers (Values 6, 19, 22) into their
-    solved indices [6, 19, 22].
-    """
-    # Check if solved stickers 6, 19, 22 are at these indices.
-    def is_normalized(s):
-        return (s[6] == 6 and s[19] == 19 and s[22] == 22)
-
-    if is_normalized(state):
-        return state, []
-
-    # BFS for orientation using virtual rotations
-    queue = deque([(state, [])])
-    visited = {state}
-    
-    while queue:
-        curr, path = queue.popleft()
-        
-        for rot in ['x', 'y']:
-            nxt = apply_cube_rotation(curr, rot)
-            if nxt not in visited:
-                if is_normalized(nxt):
-                    return nxt, path + [rot]
-                visited.add(nxt)
-                queue.append((nxt, path + [rot]))
-    
-    raise ValueError("State invalid: Fixed corner (Values 6,19,22) not found together.")
+DB_FILE = PDB_FILE
 
 def reconstruct_full_path(meet_state, forward_path, backward_db):
     """
@@ -78,101 +45,352 @@ def reconstruct_full_path(meet_state, forward_path, backward_db):
         
     return full_path + back_moves
 
-def main():
-    # --- 1. Load Database ---
-    print(f"Loading {DB_FILE}...")
+def bfs_search(start_state, backward_db, use_sym=False, log=print):
+    """
+    Forward BFS from start_state until the frontier meets the halfway DB.
+    Returns (moves, states explored); moves is None if the search is exhausted.
+    """
+    # Check if start is already in DB
+    if start_state in backward_db:
+        log("[Solver] Start state found in DB.")
+        return reconstruct_full_path(start_state, [], backward_db), 0
+
+    # Frontier nodes are (state, parent position, move code) in per-level arenas
+    arena = FrontierArena(start_state)
+    # With --sym, visited is keyed by symmetry class: one state per class
+    global_visited = {canonical_index(start_state) if use_sym else start_state}
+    explored = 0
+    step = 0
+
+    while arena.frontier:
+        frontier, codes = arena.frontier, arena.moves[step]
+        log(f"[Step {step}] Frontier Size: {len(frontier)}")
+        next_states, next_parents, next_moves = arena.new_level()
+        
+        for pos, curr_state in enumerate(frontier):
+            
+            # Expand using restricted moves (Must match DB generation),
+            # skipping moves that can't start a shorter canonical sequence
+            allowed = ALLOWED_MOVES[codes[pos]]
+            children = [apply_move_index(curr_state, m) for m in allowed]
+            keys = canonical_indices(children).tolist() if use_sym else children
+
+            for m, nxt, key in zip(allowed, children, keys):
+                explored += 1
+                
+                # Check Intersection
+                if nxt in backward_db:
+                    forward_path = arena.path_to(step, pos) + [RESTRICTED_MOVES[m]]
+                    return reconstruct_full_path(nxt, forward_path, backward_db), explored
+                
+                # Add to next level if not visited
+                if key not in global_visited:
+                    global_visited.add(key)
+                    next_states.append(nxt)
+                    next_parents.append(pos)
+                    next_moves.append(PRUNE_NEXT_LIST[codes[pos]][m])
+        
+        step += 1
+
+    return None, explored
+
+def bidirectional_search(start_state, backward_db=None, back_roots=None, log=print):
+    """
+    Meet-in-the-middle BFS. Forward and backward frontiers are both grown a
+    whole level at a time, always on the side with the smaller frontier,
+    and every child is looked up in the other side's visited map. The
+    work stays near 2 * b^(d/2) however deep the scramble is.
+    Without a DB the backward side starts at the solved state. With one,
+    it starts at back_roots (the DB's outer layer, see outer_layer) and
+    the DB stands in for its inner levels.
+    Returns (moves, states explored); moves is None if the search is exhausted.
+    """
+    if backward_db is not None and start_state in backward_db:
+        log("[Solver] Start state found in DB.")
+        return reconstruct_full_path(start_state, [], backward_db), 0
+    if backward_db is None and start_state == SOLVED_INDEX:
+        return [], 0
+
+    forward = FrontierArena(start_state)
+    if backward_db is None:
+        backward = FrontierArena(SOLVED_INDEX)
+    else:
+        backward = FrontierArena(roots=back_roots)
+    # Visited maps: state -> (level, position) in that side's arena. The
+    # DB already covers the backward roots, so they are not repeated here.
+    forward_seen = {start_state: (0, 0)}
+    backward_seen = {SOLVED_INDEX: (0, 0)} if backward_db is None else {}
+    explored = 0
+    step = 0
+
+    while forward.frontier and backward.frontier:
+        is_forward = len(forward.frontier) <= len(backward.frontier)
+        if is_forward:
+            arena, side_seen, other_seen = forward, forward_seen, backward_seen
+        else:
+            arena, side_seen, other_seen = backward, backward_seen, forward_seen
+        level = arena.depth
+        frontier, codes = arena.frontier, arena.moves[level]
+        log(f"[Step {step}] Frontier Size: {len(frontier)} "
+            f"({'forward' if is_forward else 'backward'} level {level})")
+        next_states, next_parents, next_moves = arena.new_level()
+
+        for pos, curr_state in enumerate(frontier):
+            allowed = ALLOWED_MOVES[codes[pos]]
+            for m in allowed:
+                nxt = apply_move_index(curr_state, m)
+                explored += 1
+
+                # Check Intersection: the other side's levels, or the DB
+                # (the backward side's inner levels) when growing forward
+                hit = other_seen.get(nxt)
+                if hit is not None or (is_forward and backward_db is not None
+                                       and nxt in backward_db):
+                    path = arena.path_to(level, pos) + [RESTRICTED_MOVES[m]]
+                    if not is_forward:
+                        return forward.path_to(*hit) + backward_path(nxt, path, backward_db), explored
+                    back = backward.path_to(*hit) if hit is not None else []
+                    return path + backward_path(nxt, back, backward_db), explored
+
+                # Backward children inside the DB were visited by its inner levels
+                if nxt in side_seen or (not is_forward and backward_db is not None
+                                        and nxt in backward_db):
+                    continue
+                side_seen[nxt] = (level + 1, len(next_states))
+                next_states.append(nxt)
+                next_parents.append(pos)
+                next_moves.append(PRUNE_NEXT_LIST[codes[pos]][m])
+
+        step += 1
+
+    return None, explored
+
+def ida_star(start_state, h, log=print):
+    """
+    IDA*: depth-first search bounded by g + h, deepening the bound to the
+    smallest f that exceeded it. Only the current path is kept in memory,
+    and with an admissible h the first solution found is optimal.
+    Returns (moves, nodes expanded) or (None, nodes expanded).
+    """
+    path = []
+    expanded = 0
+
+    def dfs(state, g, bound, code):
+        nonlocal expanded
+        f = g + h[state]
+        if f > bound:
+            return f
+        if state == SOLVED_INDEX:
+            return True
+
+        minimum = float("inf")
+        # Canonical sequences only: never undo or triple-turn a face
+        for m in ALLOWED_MOVES[code]:
+            expanded += 1
+            path.append(m)
+            t = dfs(apply_move_index(state, m), g + 1, bound, PRUNE_NEXT_LIST[code][m])
+            if t is True:
+                return True
+            path.pop()
+            minimum = min(minimum, t)
+        return minimum
+
+    bound = h[start_state]
+    while True:
+        log(f"[IDA*] Bound: {bound} | Nodes Expanded: {expanded}")
+        t = dfs(start_state, 0, bound, SEQ_START)
+        if t is True:
+            return [RESTRICTED_MOVES[m] for m in path], expanded
+        if t == float("inf"):
+            return None, expanded
+        bound = t
+
+def load_solver(mode, use_sym=False, log=print):
+    """
+    Loads the DB / table needed by `mode` once and returns a function
+    solve(start_index, log) -> (moves or None, states explored).
+    Exits if the file is missing.
+    """
+    if mode in ("bfs", "bidir"):
+        table_file, hint = DB_FILE, ""
+    elif mode == "ida":
+        table_file, hint = DIST_FILE, " --mode table --depth N"
+    elif use_sym:
+        table_file, hint = SYM_DIST_FILE, " --mode table --sym"
+    else:
+        table_file, hint = DIST_FILE, " --mode table"
+
+    log(f"Loading {table_file}...")
+    t0 = time.perf_counter()
+    if mode == "bidir":
+        # The DB is optional: without one both sides start from scratch
+        try:
+            backward_db = open_pattern_db(table_file)
+        except FileNotFoundError:
+            log("No DB found; growing the backward side from the solved state.")
+            return lambda start, log=print: bidirectional_search(start, log=log)
+        back_roots = backward_db.outer_layer()
+        log(f"Database loaded in {time.perf_counter() - t0:.3f}s "
+            f"({len(back_roots)} backward roots at depth {backward_db.depth}).")
+        return lambda start, log=print: bidirectional_search(start, backward_db, back_roots, log)
     try:
-        with open(DB_FILE, "rb") as f:
-            backward_db = pickle.load(f)
+        if mode == "bfs":
+            # Single file, or the shards written by generate_db.py --mode mpi
+            backward_db = open_pattern_db(table_file)
+        elif mode == "ida":
+            h, horizon = load_heuristic(table_file)
+        elif use_sym:
+            table = load_sym_table(table_file)
+        else:
+            packed = load_distance_table(table_file)
+            moves = load_move_table() if os.path.exists(MOVES_FILE) else None
     except FileNotFoundError:
-        print(f"Error: {DB_FILE} missing. Run generate_db.py first.")
+        print(f"Error: {table_file} missing. Run generate_db.py{hint} first.", file=sys.stderr)
         sys.exit(1)
-    print("Database loaded.")
+    load_time = time.perf_counter() - t0
+
+    if mode == "bfs":
+        log(f"Database loaded in {load_time:.3f}s.")
+        return lambda start, log=print: bfs_search(start, backward_db, use_sym, log)
+    if mode == "ida":
+        log(f"Heuristic loaded in {load_time:.3f}s (exact to depth {horizon}).")
+        return lambda start, log=print: ida_star(start, h, log)
 
-    # --- 2. Setup Input ---
+    # Greedy descent: one state visited per move of the solution
+    log(f"Distance table loaded in {load_time:.3f}s.")
+    def solve_descent(start, log=print):
+        if use_sym:
+            sol = solve_with_sym_table(start, table)
+        else:
+            sol = solve_with_table(start, packed, moves)
+        return sol, len(sol) if sol is not None else 0
+    return solve_descent
+
+def solve_scramble(text, solve):
+    """
+    Parses, normalizes and solves one scramble string. Returns the JSON-ready
+    result dict used by batch mode and the solver service; a malformed
+    scramble gives an "error" entry instead of raising.
+    """
+    result = {"scramble": text}
+    t0 = time.perf_counter()
+    try:
+        start, setup_moves = prepare_state(parse_state(text))
+    except ValueError as e:
+        result["error"] = str(e)
+    else:
+        sol, explored = solve(start, log=lambda *a: None)
+        result["rotation"] = " ".join(setup_moves)
+        result["solution"] = " ".join(sol) if sol is not None else None
+        result["length"] = len(sol) if sol is not None else None
+        result["states_explored"] = explored
+    result["wall_time"] = round(time.perf_counter() - t0, 6)
+    return result
+
+def run_batch(source, solve):
+    """
+    Solves one scramble per line of `source` (a path, or '-' for stdin) and
+    prints one JSON object per scramble. Blank lines and '#' comments are skipped.
+    """
+    def fail(e):
+        print(f"Error: cannot read {source}: {e}", file=sys.stderr, flush=True)
+        sys.exit(1)
+
+    try:
+        stream = sys.stdin if source == "-" else open(source, "r")
+    except OSError as e:
+        fail(e)
+    solved = 0
+    batch_start = time.perf_counter()
+    with stream:
+        while True:
+            # Only read errors are reported as such, not failed prints
+            try:
+                line = stream.readline()
+            except (OSError, UnicodeDecodeError) as e:
+                fail(e)
+            if not line:
+                break
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+
+            result = solve_scramble(line, solve)
+            solved += result.get("solution") is not None
+            print(json.dumps(result), flush=True)
+
+    elapsed = time.perf_counter() - batch_start
+    print(f"[Batch] Solved {solved} scrambles in {elapsed:.2f}s", file=sys.stderr)
+
+def main():
+    # --- 1. Setup Input ---
     parser = argparse.ArgumentParser()
-    parser.add_argument("input", help="State string (space separated) or file path")
+    parser.add_argument("input", nargs="?", help="State string (space separated) or file path")
+    parser.add_argument("--mode", choices=["bfs", "bidir", "ida", "table"], default="bfs",
+                        help="bfs: forward BFS into halfway.pdb, bidir: BFS from both "
+                             "ends (halfway.pdb optional), ida: IDA* with a "
+                             "distance-table heuristic, table: distance table descent")
+    parser.add_argument("--sym", action="store_true",
+                        help="Visit / store one state per symmetry class (bfs and table modes)")
+    parser.add_argument("--batch", metavar="FILE",
+                        help="Solve one scramble per line of FILE ('-' for stdin), "
+                             "writing one JSON result per line")
     args = parser.parse_args()
-    
+    if not args.batch and not args.input:
+        parser.error("a state (or --batch FILE) is required")
+
+    # --- 2. Load Database ---
+    if args.batch:
+        solve = load_solver(args.mode, args.sym, log=lambda msg: print(msg, file=sys.stderr))
+        run_batch(args.batch, solve)
+        return
+    solve = load_solver(args.mode, args.sym)
+
     try:
         with open(args.input, 'r') as f:
-            content = f.read().strip()
-            start_state = tuple(map(int, content.split()))
+            start_state = parse_state(f.read())
     except FileNotFoundError:
         try:
-            start_state = tuple(map(int, args.input.split()))
+            start_state = parse_state(args.input)
         except ValueError:
             print("Error: Invalid input format.")
             sys.exit(1)
+    except ValueError:
+        print("Error: Invalid input format.")
+        sys.exit(1)
 
     print(f"[Solver] Raw State loaded.")
 
     # --- 3. Normalization Step ---
     try:
-        norm_state, setup_moves = normalize_to_fixed_corner(start_state)
-        
-        if setup_moves:
-            print("\n" + "="*40)
-            print("PRE-SOLVE ORIENTATION REQUIRED")
-            print(f"Hold the cube and rotate: {' '.join(setup_moves)}")
-            print("(x = Turn whole cube up, y = Turn whole cube left)")
-            print("="*40 + "\n")
-        else:
-            print("[Solver] Cube already oriented correctly.")
-            
-        start_state = norm_state
-        
+        start_state, setup_moves = prepare_state(start_state)
     except ValueError as e:
         print(f"Error: {e}")
         sys.exit(1)
 
-    print(f"[Solver] Solving Normalized State...")
-
-    # --- 4. Search Loop (Standard BFS) ---
-    
-    # Check if start is already in DB
-    if start_state in backward_db:
-        sol = reconstruct_full_path(start_state, [], backward_db)
-        print("\n*** SOLUTION FOUND (In DB) ***")
-        print(f"Moves: {' '.join(sol)}")
-        sys.exit(0)
-
-    # Define Restricted Moves (Must match DB generation)
-    MOVES_TO_USE = [m for m in ALL_MOVES if m[0] in ['R', 'U', 'F']]
+    if setup_moves:
+        print("\n" + "="*40)
+        print("PRE-SOLVE ORIENTATION REQUIRED")
+        print(f"Hold the cube and rotate: {' '.join(setup_moves)}")
+        print("(x = Turn whole cube up, y = Turn whole cube left)")
+        print("="*40 + "\n")
+    else:
+        print("[Solver] Cube already oriented correctly.")
 
-    frontier = [(start_state, [])]
-    global_visited = {start_state}
-    step = 0
+    print(f"[Solver] Solving Normalized State...")
 
-    while frontier:
-        print(f"[Step {step}] Frontier Size: {len(frontier)}")
-        next_frontier = []
-        
-        for curr_state, curr_path in frontier:
-            
-            # Expand using restricted moves
-            for m_name in MOVES_TO_USE:
-                nxt = apply_move(curr_state, m_name)
-                
-                # Check Intersection
-                if nxt in backward_db:
-                    final_sol = reconstruct_full_path(nxt, curr_path + [m_name], backward_db)
-                    print("\n" + "="*40)
-                    print("*** SOLUTION FOUND ***")
-                    print(f"Moves: {len(final_sol)}")
-                    print(f"Sequence: {' '.join(final_sol)}")
-                    print("="*40)
-                    sys.exit(0)
-                
-                # Add to next level if not visited
-                if nxt not in global_visited:
-                    global_visited.add(nxt)
-                    next_frontier.append((nxt, curr_path + [m_name]))
-        
-        frontier = next_frontier
-        step += 1
+    # --- 4. Search ---
+    final_sol, explored = solve(start_state)
+    if final_sol is None:
+        print("Search exhausted. No solution found (within reasonable depth).")
+        sys.exit(1)
 
-    print("Search exhausted. No solution found (within reasonable depth).")
+    print("\n" + "="*40)
+    print("*** SOLUTION FOUND ***")
+    print(f"Moves: {len(final_sol)}")
+    print(f"Sequence: {' '.join(final_sol)}")
+    print(f"States Explored: {explored}")
+    print("="*40)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
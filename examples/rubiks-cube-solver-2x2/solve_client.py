@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+solve_client.py: Command-line client for solver_service.py.
+Drop-in for `python regular_solver.py "<state>"`: sends the state to the
+running service and prints the same solution summary.
+"""
+import sys
+import json
+import socket
+import argparse
+import http.client
+
+# Kept in sync with solver_service.py; not imported so the client starts
+# without loading NumPy or the solver modules.
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8642
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """HTTPConnection over a Unix socket path."""
+
+    def __init__(self, path, timeout=None):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+def request(args, method, path, payload=None):
+    """Sends one request to the service and returns (status, decoded JSON)."""
+    if args.socket:
+        conn = UnixHTTPConnection(args.socket, timeout=args.timeout)
+    else:
+        conn = http.client.HTTPConnection(args.host, args.port, timeout=args.timeout)
+    try:
+        body = json.dumps(payload) if payload is not None else None
+        conn.request(method, path, body=body, headers={"Content-Type": "application/json"})
+        resp = conn.getresponse()
+        return resp.status, json.loads(resp.read())
+    finally:
+        conn.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Client for solver_service.py")
+    parser.add_argument("input", nargs="?", help="State string (space separated) or file path")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--socket", metavar="PATH", help="Connect to a Unix socket instead of TCP")
+    parser.add_argument("--timeout", type=float, default=300, help="Seconds to wait for a reply")
+    parser.add_argument("--json", action="store_true", help="Print the raw JSON result")
+    parser.add_argument("--stats", action="store_true", help="Print service statistics and exit")
+    args = parser.parse_args()
+    if not args.stats and not args.input:
+        parser.error("a state (or --stats) is required")
+
+    try:
+        if args.stats:
+            status, result = request(args, "GET", "/stats")
+            print(json.dumps(result, indent=2))
+            return
+
+        try:
+            with open(args.input, 'r') as f:
+                text = f.read()
+        except FileNotFoundError:
+            text = args.input
+        status, result = request(args, "POST", "/solve", {"state": text})
+    except (ConnectionError, FileNotFoundError, socket.timeout) as e:
+        print(f"Error: Solver service unreachable ({e}). Start it with solver_service.py.")
+        sys.exit(1)
+
+    if args.json:
+        print(json.dumps(result))
+        sys.exit(0 if result.get("solution") is not None else 1)
+
+    if "error" in result:
+        print(f"Error: {result['error']}")
+        sys.exit(1)
+
+    if result["rotation"]:
+        print("\n" + "="*40)
+        print("PRE-SOLVE ORIENTATION REQUIRED")
+        print(f"Hold the cube and rotate: {result['rotation']}")
+        print("(x = Turn whole cube up, y = Turn whole cube left)")
+        print("="*40 + "\n")
+
+    if result["solution"] is None:
+        print("Search exhausted. No solution found (within reasonable depth).")
+        sys.exit(1)
+
+    print("\n" + "="*40)
+    print("*** SOLUTION FOUND ***")
+    print(f"Moves: {result['length']}")
+    print(f"Sequence: {result['solution']}")
+    print(f"States Explored: {result['states_explored']}" + (" (cached)" if result.get("cached") else ""))
+    print(f"Service Time: {result['wall_time'] * 1000:.1f} ms")
+    print("="*40)
+
+if __name__ == "__main__":
+    main()
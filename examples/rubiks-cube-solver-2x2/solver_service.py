@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+solver_service.py: Resident 2x2 solver daemon.
+Loads the DB / tables once and answers solve requests over localhost HTTP
+(or a Unix socket with --socket), one thread per request. Solutions are
+kept in a bounded LRU cache keyed by the normalized state index, so every
+rotation of an already solved cube is answered without searching.
+
+    POST /solve   body: {"state": "<24 integers>"}  ->  result JSON
+    GET  /stats   cache and request counters
+"""
+import os
+import sys
+import json
+import time
+import signal
+import argparse
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from socketserver import ThreadingUnixStreamServer
+from regular_solver import load_solver, solve_scramble
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8642
+DEFAULT_CACHE_SIZE = 100000
+
+class LRUCache:
+    """Thread-safe bounded mapping that evicts the least recently used key."""
+
+    def __init__(self, maxsize=DEFAULT_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._pending = {}  # key -> Event set when its computation ends
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_compute(self, key, compute):
+        """
+        Returns (value, hit). On a miss compute() runs outside the lock, so
+        slow searches don't block lookups from other threads. Only one
+        thread computes a given key: concurrent requests for it wait for
+        that result (and count as hits) instead of searching again.
+        """
+        while True:
+            with self._lock:
+                if key in self._data:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return self._data[key], True
+                pending = self._pending.get(key)
+                if pending is None:
+                    pending = self._pending[key] = threading.Event()
+                    self.misses += 1
+                    break
+            # Look again once the other thread is done; if its compute()
+            # failed, this thread computes the key itself
+            pending.wait()
+
+        try:
+            value = compute()
+            with self._lock:
+                self._data[key] = value
+                self._data.move_to_end(key)
+                while len(self._data) > self.maxsize:
+                    self._data.popitem(last=False)
+        finally:
+            with self._lock:
+                del self._pending[key]
+            pending.set()
+        return value, False
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._data), "maxsize": self.maxsize,
+                    "hits": self.hits, "misses": self.misses}
+
+class SolverHandler(BaseHTTPRequestHandler):
+    """Request handler; the solver and cache live on the server object."""
+    protocol_version = "HTTP/1.1"
+
+    def _send_json(self, code, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/stats":
+            stats = self.server.cache.stats()
+            with self.server.requests_lock:
+                stats["requests"] = self.server.requests
+            stats["mode"] = self.server.mode
+            stats["uptime"] = round(time.time() - self.server.started, 1)
+            self._send_json(200, stats)
+        else:
+            self._send_json(404, {"error": f"Unknown path {self.path}"})
+
+    def do_POST(self):
+        if self.path != "/solve":
+            self._send_json(404, {"error": f"Unknown path {self.path}"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            text = json.loads(self.rfile.read(length))["state"]
+        except (ValueError, KeyError, TypeError):
+            self._send_json(400, {"error": 'Expected a JSON body {"state": "<24 integers>"}'})
+            return
+
+        cache, base_solve = self.server.cache, self.server.solve
+        hit = []
+        def solve(start, log):
+            value, was_hit = cache.get_or_compute(start, lambda: base_solve(start, log))
+            hit.append(was_hit)
+            return value
+
+        result = solve_scramble(str(text), solve)
+        if hit:
+            result["cached"] = hit[0]
+        # Handlers run on one thread per request
+        with self.server.requests_lock:
+            self.server.requests += 1
+        self._send_json(400 if "error" in result else 200, result)
+
+    def address_string(self):
+        # Unix socket peers have no (host, port) address
+        return self.client_address[0] if self.client_address else "unix"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+class UnixHTTPServer(ThreadingUnixStreamServer):
+    """ThreadingHTTPServer counterpart listening on a Unix socket path."""
+    daemon_threads = True
+
+def serve(args):
+    log = lambda msg: print(msg, file=sys.stderr, flush=True)
+    solve = load_solver(args.mode, args.sym, log=log)
+
+    if args.socket:
+        if os.path.exists(args.socket):
+            os.unlink(args.socket)
+        server = UnixHTTPServer(args.socket, SolverHandler)
+        where = args.socket
+    else:
+        server = ThreadingHTTPServer((args.host, args.port), SolverHandler)
+        where = f"http://{args.host}:{args.port}"
+
+    server.solve = solve
+    server.cache = LRUCache(args.cache_size)
+    server.mode = args.mode + (" (sym)" if args.sym else "")
+    server.requests = 0
+    server.requests_lock = threading.Lock()
+    server.started = time.time()
+    server.verbose = args.verbose
+
+    # Exit through the finally block on SIGTERM too, so the socket is removed
+    signal.signal(signal.SIGTERM, lambda *a: sys.exit(0))
+    log(f"[Service] Solving in {server.mode} mode on {where}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        log("[Service] Shutting down.")
+    finally:
+        server.server_close()
+        if args.socket and os.path.exists(args.socket):
+            os.unlink(args.socket)
+
+def main():
+    parser = argparse.ArgumentParser(description="Resident 2x2 solver service")
+    parser.add_argument("--mode", choices=["bfs", "bidir", "ida", "table"], default="bfs",
+                        help="Search mode, as in regular_solver.py")
+    parser.add_argument("--sym", action="store_true",
+                        help="Visit / store one state per symmetry class (bfs and table modes)")
+    parser.add_argument("--host", default=DEFAULT_HOST,
+                        help=f"Address to bind (default: {DEFAULT_HOST})")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT,
+                        help=f"TCP port (default: {DEFAULT_PORT})")
+    parser.add_argument("--socket", metavar="PATH",
+                        help="Listen on a Unix socket instead of TCP")
+    parser.add_argument("--cache-size", type=int, default=DEFAULT_CACHE_SIZE,
+                        help=f"Max cached solutions (default: {DEFAULT_CACHE_SIZE})")
+    parser.add_argument("--verbose", action="store_true", help="Log every request")
+    serve(parser.parse_args())
+
+if __name__ == "__main__":
+    main()